@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from typing import Callable
+from pathlib import Path
+from contextlib import redirect_stdout
+import argparse
+import io
+import json
+import shutil
+import tempfile
+import time
+
+import ditto
+
+BENCHMARK_SCALES = {
+    "small": dict(plugin_count=3,
+                  scale=ditto.MockPluginScale(files_per_module=4, source_file_size_range=(256, 4 * 1024),
+                                              binaries_size=256 * 1024, content_files=4,
+                                              content_file_size_range=(16 * 1024, 64 * 1024))),
+    "medium": dict(plugin_count=20,
+                   scale=ditto.MockPluginScale(files_per_module=25, source_file_size_range=(512, 16 * 1024),
+                                               binaries_size=2 * 1024 * 1024, content_files=20,
+                                               content_file_size_range=(64 * 1024, 512 * 1024))),
+    "large": dict(plugin_count=60,
+                  scale=ditto.MockPluginScale(files_per_module=100, source_file_size_range=(512, 32 * 1024),
+                                              binaries_size=8 * 1024 * 1024, content_files=50,
+                                              content_file_size_range=(128 * 1024, 2 * 1024 * 1024))),
+}
+BENCHMARK_REPEATS = 3
+BENCHMARK_FIXTURE_FILE_NAME = "fixture.json"
+
+
+def build_fixture(cache_path: Path, scale_name: str) -> Path:
+    # Fixtures are generated once per scale and reused while their parameters don't change
+    fixture_path = cache_path / scale_name
+    fixture_params = repr(BENCHMARK_SCALES[scale_name])
+    fixture_file = fixture_path / BENCHMARK_FIXTURE_FILE_NAME
+    if fixture_file.is_file() and json.loads(fixture_file.read_text()).get("Params") == fixture_params:
+        return fixture_path
+
+    shutil.rmtree(fixture_path, ignore_errors=True)
+    fixture_path.mkdir(parents=True)
+    with redirect_stdout(io.StringIO()):
+        ditto.make_mock_unreal_install(path=fixture_path, name="FakeUnrealInstall", **BENCHMARK_SCALES[scale_name])
+        ditto.make_mock_unreal_project(path=fixture_path, name="FakeUnrealProject")
+    fixture_file.write_text(json.dumps({"Params": fixture_params}))
+    return fixture_path
+
+
+def clone_fixture(fixture_path: Path, work_path: Path) -> Path:
+    # Hardlinks make a fresh copy of the fixture cost one metadata operation per file
+    shutil.rmtree(work_path, ignore_errors=True)
+    shutil.copytree(fixture_path, work_path, copy_function=ditto.copy_file_hardlink)
+    return work_path
+
+
+def time_operation(func: Callable[[], None], setup: Callable[[], None] = None,
+                   repeats: int = BENCHMARK_REPEATS) -> float:
+    best_time = float("inf")
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        func()
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return best_time
+
+
+def format_result(scale_name: str, operation: str, seconds: float, file_count: int, byte_count: int) -> str:
+    files_per_second = file_count / seconds if seconds else float("inf")
+    mb_per_second = byte_count / (1024 * 1024) / seconds if seconds else float("inf")
+    return (f"{scale_name:<8} {operation:<28} {seconds * 1000:>10.2f} ms {file_count:>8} files "
+            f"{files_per_second:>12.0f} files/s {mb_per_second:>10.1f} MB/s")
+
+
+def run_benchmarks(scale_name: str, cache_path: Path, work_path: Path) -> list[str]:
+    fixture_path = build_fixture(cache_path, scale_name)
+    clone_path = clone_fixture(fixture_path, work_path / "fixture")
+    install_path = clone_path / "FakeUnrealInstall"
+    project_path = clone_path / "FakeUnrealProject"
+    dest_path = work_path / "dest"
+    unreal_plugins = ditto.ue_marketplace_plugins(install_path)
+
+    all_files = [file_stat for plugin in unreal_plugins for _, file_stat in ditto.iter_plugin_files(plugin.root)]
+    no_binaries = ditto.PLUGIN_COPY_FILTER_NO_BINARIES
+    no_binaries_files = [file_stat for plugin in unreal_plugins
+                         for _, file_stat in ditto.iter_plugin_files(plugin.root, copy_filter=no_binaries)]
+    all_bytes = sum(file_stat.st_size for file_stat in all_files)
+    no_binaries_bytes = sum(file_stat.st_size for file_stat in no_binaries_files)
+
+    def reset_dest() -> None:
+        shutil.rmtree(dest_path, ignore_errors=True)
+        dest_path.mkdir(parents=True)
+
+    def copy_each(copy_func) -> None:
+        for unreal_plugin in unreal_plugins:
+            copy_func(unreal_plugin_path=unreal_plugin.root, dest_path=dest_path / unreal_plugin.name,
+                      overwrite_files=True)
+
+    def sync_all() -> None:
+        for unreal_plugin in unreal_plugins:
+            ditto.sync_ue_plugin(unreal_plugin_path=unreal_plugin.root, dest_path=dest_path / unreal_plugin.name)
+
+    results = [
+        format_result(scale_name, "ue_marketplace_plugins",
+                      time_operation(lambda: ditto.ue_marketplace_plugins(install_path)),
+                      len(unreal_plugins), 0),
+        format_result(scale_name, "is_ue_engine_install",
+                      time_operation(lambda: ditto.is_ue_engine_install(install_path)), 1, 0),
+        format_result(scale_name, "is_ue_project",
+                      time_operation(lambda: ditto.is_ue_project(project_path)), 1, 0),
+        format_result(scale_name, "copy_ue_plugin",
+                      time_operation(lambda: copy_each(ditto.copy_ue_plugin), setup=reset_dest),
+                      len(all_files), all_bytes),
+        format_result(scale_name, "copy_ue_plugin_no_binaries",
+                      time_operation(lambda: copy_each(ditto.copy_ue_plugin_no_binaries), setup=reset_dest),
+                      len(no_binaries_files), no_binaries_bytes),
+        format_result(scale_name, "copy_ue_plugins",
+                      time_operation(lambda: ditto.copy_ue_plugins(unreal_plugins=unreal_plugins, dest_path=dest_path,
+                                                                   overwrite_files=True),
+                                     setup=reset_dest),
+                      len(all_files), all_bytes),
+        # Destination is already up to date here, so this measures the compare-only cost of a resync
+        format_result(scale_name, "sync_ue_plugin (no changes)", time_operation(sync_all), len(all_files), 0),
+    ]
+    shutil.rmtree(work_path, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark Ditto discovery and copy functions")
+    parser.add_argument("--scales", nargs="+", choices=tuple(BENCHMARK_SCALES), default=["small", "medium"])
+    parser.add_argument("--cache", type=Path, default=Path(tempfile.gettempdir()) / "ditto_benchmark_fixtures")
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    report_lines = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for benchmark_scale_name in args.scales:
+            for result_line in run_benchmarks(benchmark_scale_name, cache_path=args.cache,
+                                              work_path=Path(temp_dir) / benchmark_scale_name):
+                print(result_line)
+                report_lines.append(result_line)
+
+    if args.output is not None:
+        args.output.write_text("\n".join(report_lines) + "\n")
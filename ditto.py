@@ -1,12 +1,37 @@
 from __future__ import annotations
 
-from typing import Optional, Sequence
+from typing import Callable, Iterator, Optional, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from enum import Enum
+from functools import lru_cache
+from itertools import accumulate
+import errno
+import hashlib
 import json
 import os
+import re
 import shutil
+import sqlite3
+import queue
+import threading
+import time
+import random
+import zipfile
+import select
+import struct
+import subprocess
+import sys
+import ctypes
+import ctypes.util
 from pathlib import Path
 from dataclasses import dataclass, field
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 UE_ENGINE_FOLDER_NAME = "Engine"
 UE_ENGINE_BUILD_FOLDER_NAME = "Build"
 UE_ENGINE_BUILD_VERSION_FILE_NAME = "Build.version"
@@ -19,6 +44,7 @@ UE_MARKETPLACE_PLUGINS_FOLDER_NAME = "Marketplace"
 UE_CONFIG_FOLDER_NAME = "Config"
 UE_CONTENT_FOLDER_NAME = "Content"
 UE_SOURCE_FOLDER_NAME = "Source"
+UE_INTERMEDIATE_FOLDER_NAME = "Intermediate"
 UE_PRIVATE_FOLDER_NAME = "Private"
 UE_PUBLIC_FOLDER_NAME = "Public"
 
@@ -29,21 +55,599 @@ UE_CPP_SOURCE_EXT = "cpp"
 UE_CPP_HEADER_EXT = "h"
 UE_BUILD_CSHARP_EXT = f"{UE_ENGINE_BUILD_FOLDER_NAME}.cs"
 
+HASH_CHUNK_SIZE = 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+# Allow for filesystems (network shares, NTFS) that store mtime with less precision than the source
+MTIME_TOLERANCE_NS = 1_000_000
+PLUGIN_MANIFEST_SUFFIX = ".ditto-manifest.json"
+PLUGIN_MANIFEST_FORMAT_VERSION = 1
+
+# Folders that can hold hundreds of thousands of files but never an engine install or project
+UE_DISCOVERY_PRUNED_FOLDER_NAMES = frozenset(("Intermediate", "DerivedDataCache", "Saved", "node_modules",
+                                              "$RECYCLE.BIN", "System Volume Information"))
+UE_DISCOVERY_MAX_DEPTH = 4
+
+# Files every plugin with editor binaries has, used to tell whether a copy filter keeps Binaries
+UE_BINARIES_PROBE_PATHS = (f"{UE_BINARIES_FOLDER_NAME}/{UE_PLATFORM_WINDOWS_NAME}/{UE_ENGINE_EDITOR_MODULES_FILE_NAME}",
+                           f"{UE_BINARIES_FOLDER_NAME}/{UE_PLATFORM_WINDOWS_NAME}/UnrealEditor-Plugin.dll")
+
+# Relative markers (parent folders, name) checked against cached directory listings when classifying folders
+UE_ENGINE_INSTALL_DIR_MARKERS = (((UE_ENGINE_FOLDER_NAME,), UE_BINARIES_FOLDER_NAME),
+                                 ((UE_ENGINE_FOLDER_NAME,), UE_ENGINE_BUILD_FOLDER_NAME))
+UE_ENGINE_INSTALL_FILE_MARKERS = (((UE_ENGINE_FOLDER_NAME, UE_ENGINE_BUILD_FOLDER_NAME),
+                                   UE_ENGINE_BUILD_VERSION_FILE_NAME),)
+UE_REGISTRY_FORMAT_VERSION = 1
+UE_COMPATIBILITY_INDEX_FORMAT_VERSION = 1
+
+MOCK_MARKETPLACE_PLUGIN_NAMES = ("FakeMarketplaceZero", "FakeMarketplaceOne", "FakeMarketplaceTwo")
+MOCK_ENGINE_PLUGIN_NAMES = ("Blank", "Script")
+
+PLUGIN_STORE_OBJECTS_FOLDER_NAME = "objects"
+PLUGIN_STORE_TREES_FOLDER_NAME = "trees"
+PLUGIN_STORE_SOURCES_FOLDER_NAME = "sources"
+
+PLUGIN_STAGING_FOLDER_NAME = "Ditto"
+PLUGIN_STAGING_SUFFIX = ".ditto-staging"
+PLUGIN_JOURNAL_SUFFIX = ".ditto-journal"
+PLUGIN_SWAP_SUFFIX = ".ditto-old"
+JOURNAL_FSYNC_INTERVAL = 64
+# linux/fs.h
+RENAME_EXCHANGE = 2
+AT_FDCWD = -100
+
+PLUGIN_PACK_INDEX_NAME = ".ditto-pack-index.json"
+PLUGIN_PACK_FORMAT_VERSION = 1
+# Already compressed formats are stored as is, deflating them again only costs CPU
+PLUGIN_PACK_STORED_EXTS = frozenset(("uasset", "umap", "uexp", "ubulk", "png", "jpg", "jpeg", "zip", "7z", "gz"))
+
+PLUGIN_BUILD_STATE_SUFFIX = ".ditto-build.json"
+PLUGIN_BUILD_MAX_JOBS = 2
+
+WATCH_DEBOUNCE_SECONDS = 2.0
+WATCH_POLL_INTERVAL_SECONDS = 10.0
+# linux/inotify.h
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                      | IN_DELETE_SELF)
+
+PIPELINE_QUEUE_SIZE = 8
+PIPELINE_POLL_INTERVAL = 0.05
+
+# linux/fs.h: _IOW(0x94, 9, int)
+LINUX_FICLONE = 0x40049409
+# Errors meaning "this filesystem/OS can't do that", after which a normal copy is used instead.
+# Access errors are real failures and are raised like any other error.
+COPY_BACKEND_UNSUPPORTED_ERRNOS = frozenset(
+    code for code in (getattr(errno, name, None)
+                      for name in ("EXDEV", "EMLINK", "EINVAL", "ENOTTY", "ENOSYS", "EOPNOTSUPP", "ENOTSUP"))
+    if code is not None)
+# Filesystems without hardlinks (FAT, exFAT, some SMB shares) and protected_hardlinks fail os.link with EPERM
+HARDLINK_UNSUPPORTED_ERRNOS = COPY_BACKEND_UNSUPPORTED_ERRNOS | {errno.EPERM}
+
+
+class UEFolderKind(str, Enum):
+    ENGINE_INSTALL = "engine_install"
+    PROJECT = "project"
+    NONE = "none"
+
+
+class CopyBackend(str, Enum):
+    COPY = "copy"
+    HARDLINK = "hardlink"
+    REFLINK = "reflink"
+    COPY_FILE_RANGE = "copy_file_range"
+
+
+@dataclass(frozen=True)
+class PluginCopyFilter:
+    # Patterns are matched against posix paths relative to the plugin root:
+    #   - without a "/" they match any file or folder name, e.g. "Intermediate" or "*.pdb"
+    #   - with a "/" they are anchored to the plugin root, e.g. "Binaries/*" or "Content"
+    # "*" and "?" never cross a "/", "**" does.
+    # A path is skipped when it, or one of its folders, matches `exclude`, unless that match is overridden by
+    # an `include` match at the same or a deeper level. So exclude=("Binaries/*", "*.pdb"),
+    # include=("Binaries/Win64",) keeps Binaries/Win64 but still drops the .pdb files inside it.
+    # Folders that can't contain anything kept are pruned without being listed.
+    exclude: tuple[str, ...] = ()
+    include: tuple[str, ...] = ()
+
+    @property
+    def copies_binaries(self) -> bool:
+        # Whether the editor binaries of a plugin make it through, not just whether Binaries is walked
+        return all(self.accepts(rel_path) for rel_path in UE_BINARIES_PROBE_PATHS)
+
+    def with_binaries(self, copy_binaries: bool) -> PluginCopyFilter:
+        if copy_binaries == self.copies_binaries:
+            return self
+        if copy_binaries:
+            # Drop the excludes aimed at Binaries, then include it explicitly if broader excludes still block it
+            copy_filter = PluginCopyFilter(exclude=tuple(pattern for pattern in self.exclude
+                                                         if not is_binaries_pattern(pattern)),
+                                           include=self.include)
+            if not copy_filter.copies_binaries:
+                copy_filter = PluginCopyFilter(exclude=copy_filter.exclude,
+                                               include=copy_filter.include + (f"{UE_BINARIES_FOLDER_NAME}/**",))
+            return copy_filter
+        # Drop includes that would pull parts of Binaries back in
+        return PluginCopyFilter(exclude=self.exclude + (UE_BINARIES_FOLDER_NAME,),
+                                include=tuple(pattern for pattern in self.include if not matches_binaries(pattern)))
+
+    def accepts(self, rel_path: str) -> bool:
+        exclude_regex = compile_filter_patterns(self.exclude)
+        if exclude_regex is None or not compile_filter_patterns(self.exclude, subtree=True).search(rel_path):
+            return True
+        include_regex = compile_filter_patterns(self.include)
+        excluded = False
+        separator_index = -1
+        while True:
+            separator_index = rel_path.find("/", separator_index + 1)
+            prefix = rel_path if separator_index == -1 else rel_path[:separator_index]
+            if include_regex is not None and include_regex.search(prefix):
+                excluded = False
+            elif exclude_regex.search(prefix):
+                excluded = True
+            if separator_index == -1:
+                return not excluded
+
+    def descends(self, rel_dir: str) -> bool:
+        return self.accepts(rel_dir) or may_include_below(self.include, rel_dir)
+
+    def copytree_ignore(self, root: os.PathLike) -> Callable[[str, list[str]], set[str]]:
+        # For shutil.copytree(ignore=...), so copytree based copies apply exactly the same rules
+        root = os.fspath(root)
+
+        def ignore(dir_path: str, names: list[str]) -> set[str]:
+            rel_dir = os.path.relpath(dir_path, root).replace(os.sep, "/")
+            ignored = set()
+            for name in names:
+                rel_path = name if rel_dir == "." else f"{rel_dir}/{name}"
+                if os.path.isdir(os.path.join(dir_path, name)):
+                    if not self.descends(rel_path):
+                        ignored.add(name)
+                elif not self.accepts(rel_path):
+                    ignored.add(name)
+            return ignored
+        return ignore
+
+
+PLUGIN_COPY_FILTER_ALL = PluginCopyFilter()
+PLUGIN_COPY_FILTER_NO_BINARIES = PluginCopyFilter(exclude=(UE_BINARIES_FOLDER_NAME,))
+PLUGIN_COPY_FILTER_NO_BUILD_ARTIFACTS = PluginCopyFilter(exclude=("Intermediate", "Saved", "*.pdb"))
+PLUGIN_COPY_FILTER_SOURCE_ONLY = PluginCopyFilter(exclude=("/*",), include=(UE_SOURCE_FOLDER_NAME,))
+
+
+@dataclass(frozen=True)
+class DirectoryListing:
+    dirs: frozenset[str]
+    files: frozenset[str]
+    symlinks: frozenset[str]
+
 
 @dataclass
+class PhaseMetrics:
+    phase: str
+    plugin: Optional[str] = None
+    wall_time: float = 0.0
+    bytes_copied: int = 0
+    files_touched: int = 0
+    stats_issued: int = 0
+    errors: list[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "Phase": self.phase,
+            "Plugin": self.plugin,
+            "WallTime": self.wall_time,
+            "BytesCopied": self.bytes_copied,
+            "FilesTouched": self.files_touched,
+            "StatsIssued": self.stats_issued,
+            "Errors": list(self.errors)
+        }
+
+
+# Called with the PhaseMetrics of every finished phase, see register_ditto_hook()
+DITTO_HOOKS: list[Callable[[PhaseMetrics], None]] = []
+
+
+class DittoReport:
+    # Hook that collects every phase of a run, e.g. for dumping to a dashboard
+
+    def __init__(self):
+        self.phases: list[PhaseMetrics] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, metrics: PhaseMetrics) -> None:
+        with self._lock:
+            self.phases.append(metrics)
+
+    def totals(self) -> dict[str, dict]:
+        totals = {}
+        with self._lock:
+            for metrics in self.phases:
+                phase_totals = totals.setdefault(metrics.phase, {"Count": 0, "WallTime": 0.0, "BytesCopied": 0,
+                                                                 "FilesTouched": 0, "StatsIssued": 0, "Errors": 0})
+                phase_totals["Count"] += 1
+                phase_totals["WallTime"] += metrics.wall_time
+                phase_totals["BytesCopied"] += metrics.bytes_copied
+                phase_totals["FilesTouched"] += metrics.files_touched
+                phase_totals["StatsIssued"] += metrics.stats_issued
+                phase_totals["Errors"] += len(metrics.errors)
+        return totals
+
+    def to_dict(self) -> dict:
+        totals = self.totals()
+        with self._lock:
+            phases = [metrics.to_dict() for metrics in self.phases]
+        return {"Totals": totals, "Phases": phases}
+
+    def dump_json(self, report_path: os.PathLike) -> None:
+        with open(report_path, "w") as f:
+            json.dump(self.to_dict(), fp=f, indent=4)
+
+
+@dataclass(frozen=True)
+class MockPluginScale:
+    # Extra volume for mock plugins so that discovery/copy can be measured on realistic trees.
+    # File sizes are drawn uniformly from the (min, max) ranges in bytes.
+    files_per_module: int = 1
+    source_file_size_range: tuple[int, int] = (0, 0)
+    binaries_size: int = 0
+    content_files: int = 0
+    content_file_size_range: tuple[int, int] = (0, 0)
+    seed: int = 0
+
+
+class DirectoryListingCache:
+    # Every directory is listed at most once, all following checks are answered from memory.
+    # On network shares this turns one round trip per exists()/is_dir() into one per directory.
+
+    def __init__(self):
+        self._listings: dict[Path, Optional[DirectoryListing]] = {}
+        self._lock = threading.Lock()
+        self.listings_issued = 0
+
+    def listing(self, path: Path) -> Optional[DirectoryListing]:
+        try:
+            return self._listings[path]
+        except KeyError:
+            pass
+
+        dirs, files, symlinks = [], [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_symlink():
+                        symlinks.append(entry.name)
+                    (dirs if entry.is_dir() else files).append(entry.name)
+            listing = DirectoryListing(dirs=frozenset(dirs), files=frozenset(files), symlinks=frozenset(symlinks))
+        except (PermissionError, FileNotFoundError, NotADirectoryError):
+            listing = None
+
+        with self._lock:
+            self.listings_issued += 1
+            return self._listings.setdefault(path, listing)
+
+    def is_dir(self, path: Path) -> bool:
+        listing = self.listing(path.parent)
+        return listing is not None and path.name in listing.dirs
+
+    def is_file(self, path: Path) -> bool:
+        listing = self.listing(path.parent)
+        return listing is not None and path.name in listing.files
+
+
 class UnrealPlugin:
-    plugin_file: Path
-    copy_binaries: bool
-    root: Path = field(init=False)
-    name: str = field(init=False)
-    version: str = field(init=False)
-    version_name: str = field(init=False)
+    # __slots__ keeps hundreds of plugin records small. The .uplugin JSON is only parsed when one of the
+    # metadata properties is first used and is re-parsed only when the file's mtime changes.
+    __slots__ = ("plugin_file", "copy_filter", "root", "name", "_metadata", "_metadata_mtime_ns")
+
+    def __init__(self, plugin_file: Path, copy_binaries: Optional[bool] = None,
+                 copy_filter: Optional[PluginCopyFilter] = None):
+        # copy_binaries is kept for callers that only need the old on/off switch for Binaries
+        self.plugin_file = plugin_file
+        self.copy_filter = copy_filter if copy_filter is not None else PLUGIN_COPY_FILTER_ALL
+        if copy_binaries is not None:
+            self.copy_filter = self.copy_filter.with_binaries(copy_binaries)
+        self.root = plugin_file.parent
+        self.name = plugin_file.stem
+        self._metadata: Optional[dict] = None
+        self._metadata_mtime_ns: Optional[int] = None
+
+    def __repr__(self) -> str:
+        return (f"{type(self).__name__}(plugin_file={self.plugin_file!r}, copy_filter={self.copy_filter!r}, "
+                f"root={self.root!r}, name={self.name!r})")
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, UnrealPlugin):
+            return NotImplemented
+        return (self.plugin_file, self.copy_filter) == (other.plugin_file, other.copy_filter)
+
+    __hash__ = None
+
+    @property
+    def copy_binaries(self) -> bool:
+        return self.copy_filter.copies_binaries
+
+    @copy_binaries.setter
+    def copy_binaries(self, copy_binaries: bool) -> None:
+        self.copy_filter = self.copy_filter.with_binaries(copy_binaries)
+
+    @property
+    def metadata(self) -> dict:
+        mtime_ns = self.plugin_file.stat().st_mtime_ns
+        if self._metadata is None or mtime_ns != self._metadata_mtime_ns:
+            with track_phase("load_metadata", plugin=self.name) as metrics:
+                # utf-8-sig as .uplugin files saved by Visual Studio often start with a BOM
+                with self.plugin_file.open("r", encoding="utf-8-sig") as f:
+                    self._metadata = json.load(f)
+                self._metadata_mtime_ns = mtime_ns
+                metrics.files_touched = 1
+        return self._metadata
+
+    @property
+    def version(self) -> str:
+        return str(self.metadata.get("Version", 1))
+
+    @property
+    def version_name(self) -> str:
+        return str(self.metadata.get("VersionName", 0.0))
+
+    @property
+    def modules(self) -> tuple[dict, ...]:
+        return tuple(self.metadata.get("Modules", ()))
+
+    @property
+    def plugin_dependencies(self) -> tuple[dict, ...]:
+        return tuple(self.metadata.get("Plugins", ()))
+
+
+@dataclass
+class PluginSyncSummary:
+    # All paths are relative to the plugin root
+    copied: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    unchanged: list[str] = field(default_factory=list)
+    bytes_copied: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.copied or self.updated or self.deleted)
+
+
+@dataclass(frozen=True)
+class PluginCopyTask:
+    src: Path
+    dest: Path
+    size: int
+
+
+@dataclass
+class PluginCopyPlan:
+    dest_roots: list[Path] = field(default_factory=list)
+    dest_dirs: set[Path] = field(default_factory=set)
+    tasks: list[PluginCopyTask] = field(default_factory=list)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(task.size for task in self.tasks)
+
+
+@dataclass
+class FanOutResult:
+    dest_path: Path
+    files_written: int = 0
+    bytes_written: int = 0
+    # (relative path or "" for the whole destination, error message)
+    errors: list[tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+class PluginVerificationError(Exception):
+    pass
+
+
+class PluginResolutionError(Exception):
+    pass
+
+
+@dataclass
+class PluginResolution:
+    plugins: list[UnrealPlugin] = field(default_factory=list)
+    # Plugin name -> the chain of references that asked for it, e.g. ("Project.uproject", "SomePlugin")
+    missing: dict[str, tuple[str, ...]] = field(default_factory=dict)
+
+
+@dataclass
+class PluginPipelineResult:
+    plugin: Optional[UnrealPlugin]
+    dest_path: Optional[Path] = None
+    copied: bool = False
+    verified: bool = False
+    error: Optional[Exception] = None
+    failed_stage: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass(frozen=True)
+class PluginManifestEntry:
+    size: int
+    mtime_ns: int
+    hash: str
+
+
+@dataclass
+class PluginManifest:
+    name: str
+    version: str
+    # Keyed by relative posix path from the plugin root
+    files: dict[str, PluginManifestEntry] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "FormatVersion": PLUGIN_MANIFEST_FORMAT_VERSION,
+            "Name": self.name,
+            "Version": self.version,
+            "Files": {rel_path: [entry.size, entry.mtime_ns, entry.hash]
+                      for rel_path, entry in sorted(self.files.items())}
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> PluginManifest:
+        files = {rel_path: PluginManifestEntry(size=size, mtime_ns=mtime_ns, hash=file_hash)
+                 for rel_path, (size, mtime_ns, file_hash) in data["Files"].items()}
+        return cls(name=data["Name"], version=data["Version"], files=files)
+
+
+@dataclass
+class PluginManifestChanges:
+    name: str
+    version: str
+    previous_version: Optional[str] = None
+    added: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.modified or self.removed or self.version != self.previous_version)
+
 
-    def __post_init__(self):
-        self.root = self.plugin_file.parent
-        self.name = self.plugin_file.stem
-        self.version = str(1)
-        self.version_name = str(0.0)
+@dataclass
+class PluginDiff:
+    # All paths are relative to the plugin root.
+    # upstream_changed also covers files added or removed upstream, locally_modified files added or removed locally.
+    name: str
+    unchanged: list[str] = field(default_factory=list)
+    upstream_changed: list[str] = field(default_factory=list)
+    locally_modified: list[str] = field(default_factory=list)
+    both_changed: list[str] = field(default_factory=list)
+
+    @property
+    def has_local_changes(self) -> bool:
+        return bool(self.locally_modified or self.both_changed)
+
+
+@dataclass
+class PluginStoreCheck:
+    # Object hashes referenced by a tree but missing from the store, and objects whose bytes no longer match
+    missing: list[str] = field(default_factory=list)
+    corrupt: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing or self.corrupt)
+
+
+@dataclass
+class PluginStoreCollection:
+    removed_objects: int = 0
+    freed_bytes: int = 0
+
+
+@dataclass(frozen=True)
+class PluginPackEntry:
+    size: int
+    mtime_ns: int
+    hash: str
+    # Set when the bytes aren't in this pack but in the base pack, under base_path
+    base_path: Optional[str] = None
+
+
+@dataclass
+class PluginPackIndex:
+    name: str
+    version: str
+    files: dict[str, PluginPackEntry] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "FormatVersion": PLUGIN_PACK_FORMAT_VERSION,
+            "Name": self.name,
+            "Version": self.version,
+            "Files": {rel_path: [entry.size, entry.mtime_ns, entry.hash, entry.base_path]
+                      for rel_path, entry in sorted(self.files.items())}
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> PluginPackIndex:
+        if data.get("FormatVersion") != PLUGIN_PACK_FORMAT_VERSION:
+            raise ValueError(f"Unsupported plugin pack format: {data.get('FormatVersion')}")
+        files = {rel_path: PluginPackEntry(size=size, mtime_ns=mtime_ns, hash=file_hash, base_path=base_path)
+                 for rel_path, (size, mtime_ns, file_hash, base_path) in data["Files"].items()}
+        return cls(name=data["Name"], version=data["Version"], files=files)
+
+
+@dataclass
+class PluginBuildResult:
+    name: str
+    reason: str
+    skipped: bool = False
+    returncode: Optional[int] = None
+    output: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return not self.skipped and self.returncode == 0
+
+
+@dataclass
+class UERegistry:
+    roots: list[Path] = field(default_factory=list)
+    engine_installs: list[Path] = field(default_factory=list)
+    projects: list[Path] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "FormatVersion": UE_REGISTRY_FORMAT_VERSION,
+            "Roots": [os.fspath(root) for root in self.roots],
+            "EngineInstalls": [os.fspath(engine_install) for engine_install in self.engine_installs],
+            "Projects": [os.fspath(project) for project in self.projects]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> UERegistry:
+        return cls(roots=[Path(root) for root in data["Roots"]],
+                   engine_installs=[Path(engine_install) for engine_install in data["EngineInstalls"]],
+                   projects=[Path(project) for project in data["Projects"]])
+
+
+@dataclass(frozen=True)
+class UEEngineRecord:
+    root: Path
+    major_version: Optional[int]
+    minor_version: Optional[int]
+    patch_version: Optional[int]
+    compatible_changelist: Optional[int]
+    build_id: Optional[str]
+
+
+@dataclass(frozen=True)
+class UEPluginRecord:
+    name: str
+    owner_root: Path
+    plugin_file: Path
+    version: int
+    version_name: str
+    build_id: Optional[str]
 
 
 def create_empty_file(path: os.PathLike) -> None:
@@ -81,8 +685,62 @@ def create_unreal_build_csharp_file(path: os.PathLike, module_name: str) -> None
         f.writelines(lines)
 
 
+def register_ditto_hook(hook: Callable[[PhaseMetrics], None]) -> None:
+    DITTO_HOOKS.append(hook)
+
+
+def unregister_ditto_hook(hook: Callable[[PhaseMetrics], None]) -> None:
+    DITTO_HOOKS.remove(hook)
+
+
+@contextmanager
+def ditto_report() -> Iterator[DittoReport]:
+    report = DittoReport()
+    register_ditto_hook(report)
+    try:
+        yield report
+    finally:
+        unregister_ditto_hook(report)
+
+
+@contextmanager
+def track_phase(phase: str, plugin: Optional[str] = None) -> Iterator[PhaseMetrics]:
+    metrics = PhaseMetrics(phase=phase, plugin=plugin)
+    start_time = time.perf_counter()
+    try:
+        yield metrics
+    except Exception as error:
+        metrics.errors.append(f"{type(error).__name__}: {error}")
+        raise
+    finally:
+        metrics.wall_time = time.perf_counter() - start_time
+        for hook in tuple(DITTO_HOOKS):
+            # A broken hook must never fail the operation it observes or replace the error it raised
+            try:
+                hook(metrics)
+            except Exception:
+                pass
+
+
+def tracked_copy_function(copy_function: Callable[[os.PathLike, os.PathLike], os.PathLike],
+                          metrics: PhaseMetrics) -> Callable[[os.PathLike, os.PathLike], os.PathLike]:
+    metrics_lock = threading.Lock()
+
+    def copy_and_track(src: os.PathLike, dest: os.PathLike) -> os.PathLike:
+        result = copy_function(src, dest)
+        size = os.stat(dest).st_size
+        with metrics_lock:
+            metrics.bytes_copied += size
+            metrics.files_touched += 1
+            metrics.stats_issued += 1
+        return result
+    return copy_and_track
+
+
 def match_ue_filepath_in_folder(unreal_path: Path, unreal_file_name: str,
-                                dirs_to_join: Sequence[str]) -> bool:
+                                dirs_to_join: Sequence[str], metrics: Optional[PhaseMetrics] = None) -> bool:
+    if metrics is not None:
+        metrics.stats_issued += 1
     if unreal_path.exists():
         unreal_file_path = unreal_path / unreal_file_name
     else:
@@ -106,41 +764,1905 @@ def is_ue_engine_install(unreal_install_path: Path) -> bool:
     engine_build_path = engine_path / UE_ENGINE_BUILD_FOLDER_NAME
 
     engine_build_dirs = UE_ENGINE_FOLDER_NAME, UE_ENGINE_BUILD_FOLDER_NAME
-    return (engine_binaries_path.exists()
-            and match_ue_filepath_in_folder(
-                unreal_path=engine_build_path,
-                unreal_file_name=UE_ENGINE_BUILD_VERSION_FILE_NAME,
-                dirs_to_join=engine_build_dirs))
+    with track_phase("is_ue_engine_install") as metrics:
+        metrics.stats_issued += 1
+        return (engine_binaries_path.exists()
+                and match_ue_filepath_in_folder(
+                    unreal_path=engine_build_path,
+                    unreal_file_name=UE_ENGINE_BUILD_VERSION_FILE_NAME,
+                    dirs_to_join=engine_build_dirs,
+                    metrics=metrics))
 
 def is_ue_project(unreal_project_path: Path) -> bool:
     uproject_file_name = f"{unreal_project_path.stem}.{UE_UPROJECT_EXT}"
-    return match_ue_filepath_in_folder(unreal_path=unreal_project_path,
-                                       unreal_file_name=uproject_file_name,
-                                       dirs_to_join=(unreal_project_path.stem,))
+    with track_phase("is_ue_project") as metrics:
+        return match_ue_filepath_in_folder(unreal_path=unreal_project_path,
+                                           unreal_file_name=uproject_file_name,
+                                           dirs_to_join=(unreal_project_path.stem,),
+                                           metrics=metrics)
 
 
-def ue_marketplace_plugins(unreal_install_path: Path) -> tuple | tuple[UnrealPlugin]:
+def classify_ue_folder(folder_path: Path, listing_cache: Optional[DirectoryListingCache] = None) -> UEFolderKind:
+    listing_cache = listing_cache if listing_cache is not None else DirectoryListingCache()
+    listing = listing_cache.listing(folder_path)
+    if listing is None:
+        return UEFolderKind.NONE
+
+    if (UE_ENGINE_FOLDER_NAME in listing.dirs
+            and all(listing_cache.is_dir(folder_path.joinpath(*parents, name))
+                    for parents, name in UE_ENGINE_INSTALL_DIR_MARKERS)
+            and all(listing_cache.is_file(folder_path.joinpath(*parents, name))
+                    for parents, name in UE_ENGINE_INSTALL_FILE_MARKERS)):
+        return UEFolderKind.ENGINE_INSTALL
+    if f"{folder_path.name}.{UE_UPROJECT_EXT}" in listing.files:
+        return UEFolderKind.PROJECT
+    return UEFolderKind.NONE
+
+
+def classify_ue_folders(folder_paths: Sequence[os.PathLike], listing_cache: Optional[DirectoryListingCache] = None,
+                        max_workers: Optional[int] = None) -> dict[Path, UEFolderKind]:
+    listing_cache = listing_cache if listing_cache is not None else DirectoryListingCache()
+    folder_paths = [Path(folder_path) for folder_path in folder_paths]
+    with track_phase("classify_ue_folders") as metrics:
+        listings_issued = listing_cache.listings_issued
+        # Listing is I/O bound (and latency bound on network shares), so classify on a thread pool
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            folder_kinds = dict(zip(folder_paths, executor.map(
+                lambda folder_path: classify_ue_folder(folder_path, listing_cache), folder_paths)))
+        metrics.files_touched = len(folder_paths)
+        metrics.stats_issued = listing_cache.listings_issued - listings_issued
+        return folder_kinds
+
+
+def scan_ue_root(root: Path, max_depth: int = UE_DISCOVERY_MAX_DEPTH,
+                 pruned_folder_names: frozenset[str] = UE_DISCOVERY_PRUNED_FOLDER_NAMES) -> tuple[list[Path], list[Path]]:
+    engine_installs = []
+    projects = []
+    listing_cache = DirectoryListingCache()
+    pending_dirs = [(Path(root), 0)]
+    while pending_dirs:
+        current_dir, depth = pending_dirs.pop()
+        folder_kind = classify_ue_folder(current_dir, listing_cache)
+        # Engine installs and projects are leaves, nothing inside them needs scanning
+        if folder_kind == UEFolderKind.ENGINE_INSTALL:
+            engine_installs.append(current_dir)
+            continue
+        if folder_kind == UEFolderKind.PROJECT:
+            projects.append(current_dir)
+            continue
+
+        listing = listing_cache.listing(current_dir)
+        if listing is None or depth >= max_depth:
+            continue
+        for sub_dir_name in listing.dirs - listing.symlinks:
+            if sub_dir_name in pruned_folder_names or sub_dir_name.startswith("."):
+                continue
+            pending_dirs.append((current_dir / sub_dir_name, depth + 1))
+    return engine_installs, projects
+
+
+def discover_ue_environments(roots: Sequence[os.PathLike], max_depth: int = UE_DISCOVERY_MAX_DEPTH,
+                             pruned_folder_names: frozenset[str] = UE_DISCOVERY_PRUNED_FOLDER_NAMES,
+                             max_workers: Optional[int] = None) -> UERegistry:
+    registry = UERegistry(roots=[Path(root) for root in roots])
+    # Roots are usually separate volumes/shares so they are scanned in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda root: scan_ue_root(root, max_depth=max_depth,
+                                                         pruned_folder_names=pruned_folder_names),
+                               registry.roots)
+        for engine_installs, projects in results:
+            registry.engine_installs.extend(engine_installs)
+            registry.projects.extend(projects)
+    registry.engine_installs.sort()
+    registry.projects.sort()
+    return registry
+
+
+def revalidate_ue_registry(registry: UERegistry, max_workers: Optional[int] = None) -> UERegistry:
+    folder_kinds = classify_ue_folders(registry.engine_installs + registry.projects, max_workers=max_workers)
+    return UERegistry(roots=list(registry.roots),
+                      engine_installs=[path for path in registry.engine_installs
+                                       if folder_kinds[path] == UEFolderKind.ENGINE_INSTALL],
+                      projects=[path for path in registry.projects if folder_kinds[path] == UEFolderKind.PROJECT])
+
+
+def load_ue_registry(registry_path: os.PathLike) -> Optional[UERegistry]:
+    try:
+        with open(registry_path, "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if data.get("FormatVersion") != UE_REGISTRY_FORMAT_VERSION:
+        return None
+    return UERegistry.from_dict(data)
+
+
+def save_ue_registry(registry: UERegistry, registry_path: os.PathLike) -> None:
+    temp_path = f"{os.fspath(registry_path)}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(registry.to_dict(), fp=f, indent=4)
+    os.replace(temp_path, registry_path)
+
+
+def locate_ue_environments(roots: Sequence[os.PathLike], registry_path: os.PathLike, rescan: bool = False,
+                           max_depth: int = UE_DISCOVERY_MAX_DEPTH,
+                           max_workers: Optional[int] = None) -> UERegistry:
+    # Revalidating the cached registry costs a few stats per entry instead of walking every root again.
+    # New installs under the same roots are only picked up with rescan=True.
+    registry = None if rescan else load_ue_registry(registry_path)
+    if registry is not None and registry.roots == [Path(root) for root in roots]:
+        revalidated = revalidate_ue_registry(registry, max_workers=max_workers)
+        if revalidated != registry:
+            save_ue_registry(revalidated, registry_path)
+        return revalidated
+
+    registry = discover_ue_environments(roots, max_depth=max_depth, max_workers=max_workers)
+    save_ue_registry(registry, registry_path)
+    return registry
+
+
+def iter_ue_marketplace_plugins(unreal_install_path: Path) -> Iterator[UnrealPlugin]:
     if not is_ue_engine_install(unreal_install_path):
-        return ()
+        return
     engine_plugins_path = unreal_install_path / UE_ENGINE_FOLDER_NAME / UE_PLUGINS_FOLDER_NAME
     marketplace_plugins = engine_plugins_path.glob(f"{UE_MARKETPLACE_PLUGINS_FOLDER_NAME}/*/*.{UE_UPLUGIN_EXT}")
-    return tuple([UnrealPlugin(plugin_file=plugin_file, copy_binaries=True) for plugin_file in marketplace_plugins])
+    for plugin_file in marketplace_plugins:
+        yield UnrealPlugin(plugin_file=plugin_file)
+
+
+def ue_marketplace_plugins(unreal_install_path: Path) -> tuple | tuple[UnrealPlugin]:
+    with track_phase("ue_marketplace_plugins") as metrics:
+        marketplace_plugins = tuple(iter_ue_marketplace_plugins(unreal_install_path))
+        metrics.files_touched = len(marketplace_plugins)
+        return marketplace_plugins
+
+
+def iter_ue_engine_plugin_files(unreal_install_path: Path) -> Iterator[Path]:
+    # Every .uplugin under Engine/Plugins. Like the editor, a folder holding a .uplugin isn't searched any
+    # deeper, so the walk never enters plugin Source or Content folders.
+    pending = [unreal_install_path / UE_ENGINE_FOLDER_NAME / UE_PLUGINS_FOLDER_NAME]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                entries = list(entries)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        plugin_files = [Path(entry.path) for entry in entries
+                        if entry.name.endswith(f".{UE_UPLUGIN_EXT}") and entry.is_file()]
+        if plugin_files:
+            yield from plugin_files
+            continue
+        pending.extend(Path(entry.path) for entry in entries if entry.is_dir(follow_symlinks=False))
+
+
+def resolve_project_plugins(unreal_project_path: Path, available_plugins: Sequence[UnrealPlugin],
+                            unreal_install_paths: Sequence[Path] = (),
+                            allow_missing: bool = False) -> PluginResolution:
+    # Minimal set of available plugins the project needs: the enabled entries of the .uproject "Plugins" list
+    # and, transitively, each .uplugin's own "Plugins" dependencies. Dependencies come before their dependents.
+    # Plugins already inside the project's Plugins folder or shipped with one of unreal_install_paths
+    # (e.g. built-in plugins such as ScriptPlugin) satisfy a reference but are not returned, their
+    # dependencies are still followed. Missing optional dependencies are ignored, other missing plugins raise
+    # PluginResolutionError unless allow_missing is set, in which case they are reported in missing.
+    project_file = unreal_project_path / f"{unreal_project_path.name}.{UE_UPROJECT_EXT}"
+    project_data = read_unreal_data_file(project_file)
+    if project_data is None:
+        raise PluginResolutionError(f"Can't read project file {project_file}")
+
+    plugins_by_name: dict[str, UnrealPlugin] = {}
+    # The same plugin can be available from several installs, the highest Version wins
+    for unreal_plugin in available_plugins:
+        known_plugin = plugins_by_name.get(unreal_plugin.name)
+        if known_plugin is None or int(unreal_plugin.version) > int(known_plugin.version):
+            plugins_by_name[unreal_plugin.name] = unreal_plugin
+    installed_plugins = {plugin_file.stem: UnrealPlugin(plugin_file=plugin_file)
+                         for unreal_install_path in unreal_install_paths
+                         for plugin_file in iter_ue_engine_plugin_files(unreal_install_path)}
+    installed_plugins.update((plugin_file.stem, UnrealPlugin(plugin_file=plugin_file)) for plugin_file in
+                             (unreal_project_path / UE_PLUGINS_FOLDER_NAME).glob(f"*/*.{UE_UPLUGIN_EXT}"))
+
+    resolution = PluginResolution()
+    resolved: set[str] = set()
+    resolving: list[str] = []
+
+    def resolve(reference: dict, chain: tuple[str, ...]) -> None:
+        name = reference["Name"]
+        if not reference.get("Enabled", True) or name in resolved:
+            return
+        if name in resolving:
+            cycle = resolving[resolving.index(name):] + [name]
+            raise PluginResolutionError(f"Plugin dependency cycle: {' -> '.join(cycle)}")
+        unreal_plugin = plugins_by_name.get(name, installed_plugins.get(name))
+        if unreal_plugin is None:
+            if reference.get("Optional", False):
+                return
+            if not allow_missing:
+                raise PluginResolutionError(f"Plugin {name} required by {' -> '.join(chain)} is not available")
+            resolution.missing.setdefault(name, chain)
+            return
+
+        resolving.append(name)
+        for dependency in unreal_plugin.plugin_dependencies:
+            resolve(dependency, chain + (name,))
+        resolving.pop()
+        resolved.add(name)
+        if name in plugins_by_name:
+            resolution.plugins.append(unreal_plugin)
+
+    with track_phase("resolve_project_plugins") as metrics:
+        for reference in project_data.get("Plugins", ()):
+            resolve(reference, (project_file.name,))
+        metrics.files_touched = len(resolved)
+    return resolution
 
 
 def copy_ue_plugin(unreal_plugin_path: os.PathLike, dest_path: os.PathLike,
-                   overwrite_files: bool) -> os.PathLike:
-    return shutil.copytree(src=unreal_plugin_path, dst=dest_path,
-                           dirs_exist_ok=overwrite_files)
+                   overwrite_files: bool, backend: CopyBackend = CopyBackend.COPY,
+                   copy_filter: Optional[PluginCopyFilter] = None) -> os.PathLike:
+    ignore_pattern = copy_filter.copytree_ignore(unreal_plugin_path) if copy_filter is not None else None
+    with track_phase("copy_ue_plugin", plugin=Path(unreal_plugin_path).name) as metrics:
+        return shutil.copytree(src=unreal_plugin_path, dst=dest_path, ignore=ignore_pattern,
+                               copy_function=tracked_copy_function(copy_function_for_backend(backend), metrics),
+                               dirs_exist_ok=overwrite_files)
 
 
 def copy_ue_plugin_no_binaries(unreal_plugin_path: os.PathLike, dest_path: os.PathLike,
-                               overwrite_files: bool) -> os.PathLike:
-    ignore_pattern = shutil.ignore_patterns("Binaries")
-    return shutil.copytree(src=unreal_plugin_path, dst=dest_path, ignore=ignore_pattern,
-                           dirs_exist_ok=overwrite_files)
+                               overwrite_files: bool, backend: CopyBackend = CopyBackend.COPY) -> os.PathLike:
+    ignore_pattern = PLUGIN_COPY_FILTER_NO_BINARIES.copytree_ignore(unreal_plugin_path)
+    with track_phase("copy_ue_plugin_no_binaries", plugin=Path(unreal_plugin_path).name) as metrics:
+        return shutil.copytree(src=unreal_plugin_path, dst=dest_path, ignore=ignore_pattern,
+                               copy_function=tracked_copy_function(copy_function_for_backend(backend), metrics),
+                               dirs_exist_ok=overwrite_files)
+
+
+def is_copy_backend_unsupported(error: OSError, unsupported_errnos: frozenset[int] = COPY_BACKEND_UNSUPPORTED_ERRNOS
+                                ) -> bool:
+    return error.errno in unsupported_errnos
+
+
+def remove_existing_dest(dest: os.PathLike) -> None:
+    # Link/clone based backends must never write through an existing destination,
+    # it might be a hardlink shared with the source or a content store.
+    try:
+        os.unlink(dest)
+    except FileNotFoundError:
+        pass
+
+
+def copy_file_hardlink(src: os.PathLike, dest: os.PathLike) -> os.PathLike:
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return dest
+    remove_existing_dest(dest)
+    try:
+        os.link(src, dest)
+    except OSError as error:
+        if not is_copy_backend_unsupported(error, unsupported_errnos=HARDLINK_UNSUPPORTED_ERRNOS):
+            raise
+        return shutil.copy2(src, dest)
+    return dest
+
+
+def copy_file_reflink(src: os.PathLike, dest: os.PathLike) -> os.PathLike:
+    if fcntl is None:
+        return shutil.copy2(src, dest)
+    remove_existing_dest(dest)
+    try:
+        with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+            fcntl.ioctl(dest_file.fileno(), LINUX_FICLONE, src_file.fileno())
+    except OSError as error:
+        if not is_copy_backend_unsupported(error):
+            raise
+        return shutil.copy2(src, dest)
+    shutil.copystat(src, dest)
+    return dest
+
+
+def copy_file_kernel(src: os.PathLike, dest: os.PathLike) -> os.PathLike:
+    # In-kernel copy with os.copy_file_range (can be server-side on NFS 4.2/SMB3),
+    # then os.sendfile, then a regular user space copy.
+    kernel_copy_funcs = [func for func in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None))
+                         if func is not None]
+    remove_existing_dest(dest)
+    for kernel_copy_func in kernel_copy_funcs:
+        try:
+            with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+                remaining = os.fstat(src_file.fileno()).st_size
+                offset = 0
+                while remaining > 0:
+                    if kernel_copy_func is os.sendfile:
+                        copied = os.sendfile(dest_file.fileno(), src_file.fileno(), offset, remaining)
+                    else:
+                        copied = kernel_copy_func(src_file.fileno(), dest_file.fileno(), remaining,
+                                                  offset_src=offset, offset_dst=offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+                    remaining -= copied
+        except OSError as error:
+            if not is_copy_backend_unsupported(error):
+                raise
+            continue
+        if remaining == 0:
+            shutil.copystat(src, dest)
+            return dest
+    return shutil.copy2(src, dest)
+
+
+def copy_function_for_backend(backend: CopyBackend) -> Callable[[os.PathLike, os.PathLike], os.PathLike]:
+    return {
+        CopyBackend.COPY: shutil.copy2,
+        CopyBackend.HARDLINK: copy_file_hardlink,
+        CopyBackend.REFLINK: copy_file_reflink,
+        CopyBackend.COPY_FILE_RANGE: copy_file_kernel,
+    }[CopyBackend(backend)]
+
+
+def hash_file(path: os.PathLike, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    file_hash = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def is_same_file_state(src_stat: os.stat_result, dest_stat: os.stat_result) -> bool:
+    return (src_stat.st_size == dest_stat.st_size
+            and abs(src_stat.st_mtime_ns - dest_stat.st_mtime_ns) <= MTIME_TOLERANCE_NS)
+
+
+def translate_filter_pattern(pattern: str) -> str:
+    regex_parts = []
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**", index):
+            regex_parts.append(".*")
+            index += 2
+            continue
+        char = pattern[index]
+        regex_parts.append("[^/]*" if char == "*" else "[^/]" if char == "?" else re.escape(char))
+        index += 1
+    return "".join(regex_parts)
+
+
+@lru_cache(maxsize=None)
+def compile_filter_patterns(patterns: tuple[str, ...], subtree: bool = False) -> Optional[re.Pattern]:
+    # All patterns of a filter are compiled once into a single regex.
+    # subtree=True also matches anything below a matching folder.
+    if not patterns:
+        return None
+    alternatives = []
+    subtree_suffix = "(?:/.*)?" if subtree else ""
+    for pattern in patterns:
+        anchored = "/" in pattern.strip("/") or pattern.startswith("/")
+        pattern_regex = translate_filter_pattern(pattern.strip("/"))
+        alternatives.append(f"^{pattern_regex}{subtree_suffix}$" if anchored
+                            else f"(?:^|/){pattern_regex}{subtree_suffix}$")
+    return re.compile("|".join(f"(?:{alternative})" for alternative in alternatives))
+
+
+def is_binaries_pattern(pattern: str) -> bool:
+    return pattern.strip("/").split("/")[0] == UE_BINARIES_FOLDER_NAME
+
+
+def matches_binaries(pattern: str) -> bool:
+    # Whether the pattern matches Binaries or anything in it, e.g. "Binaries/Win64", "*.dll" or "**"
+    if is_binaries_pattern(pattern):
+        return True
+    pattern_regex = compile_filter_patterns((pattern,))
+    return any(pattern_regex.search(prefix) for rel_path in UE_BINARIES_PROBE_PATHS
+               for prefix in accumulate(rel_path.split("/"), lambda parent, name: f"{parent}/{name}"))
+
+
+@lru_cache(maxsize=4096)
+def may_include_below(include: tuple[str, ...], rel_dir: str) -> bool:
+    # Whether an include pattern could match something inside rel_dir, i.e. whether an excluded folder
+    # still has to be walked
+    dir_parts = rel_dir.split("/")
+    for pattern in include:
+        if "**" in pattern or not ("/" in pattern.strip("/") or pattern.startswith("/")):
+            return True
+        pattern_parts = pattern.strip("/").split("/")
+        if len(pattern_parts) > len(dir_parts) and all(
+                re.fullmatch(translate_filter_pattern(pattern_part), dir_part)
+                for pattern_part, dir_part in zip(pattern_parts, dir_parts)):
+            return True
+    return False
 
 
-def make_mock_unreal_plugin(path: Path, plugin_name: str) -> None:
+def iter_plugin_files(unreal_plugin_path: os.PathLike,
+                      copy_filter: Optional[PluginCopyFilter] = None) -> Iterator[tuple[str, os.stat_result]]:
+    # Yields (relative posix path, stat) for every file that a copy of the plugin would contain.
+    # Folders rejected by copy_filter are pruned before they are listed.
+    copy_filter = copy_filter if copy_filter is not None else PLUGIN_COPY_FILTER_ALL
+    unfiltered = not copy_filter.exclude
+    root = os.fspath(unreal_plugin_path)
+    pending_dirs = [""]
+    while pending_dirs:
+        rel_dir = pending_dirs.pop()
+        with os.scandir(os.path.join(root, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if unfiltered or copy_filter.descends(rel_path):
+                        pending_dirs.append(rel_path)
+                elif entry.is_file() and (unfiltered or copy_filter.accepts(rel_path)):
+                    yield rel_path, entry.stat()
+
+
+def remove_orphaned_dirs(dest_root: Path, src_root: Path) -> None:
+    # Removes empty folders in dest_root that no longer exist in src_root
+    for dir_path, _, _ in os.walk(dest_root, topdown=False):
+        rel_dir = Path(dir_path).relative_to(dest_root)
+        if rel_dir == Path(".") or (src_root / rel_dir).is_dir():
+            continue
+        if not os.listdir(dir_path):
+            os.rmdir(dir_path)
+
+
+def sync_ue_plugin(unreal_plugin_path: os.PathLike, dest_path: os.PathLike,
+                   copy_filter: Optional[PluginCopyFilter] = None,
+                   compare_hash: bool = False, delete_removed: bool = True,
+                   backend: CopyBackend = CopyBackend.COPY) -> PluginSyncSummary:
+    copy_function = copy_function_for_backend(backend)
+    src_root = Path(unreal_plugin_path)
+    dest_root = Path(dest_path)
+    with track_phase("sync_ue_plugin", plugin=src_root.name) as metrics:
+        summary = PluginSyncSummary()
+
+        src_files = dict(iter_plugin_files(src_root, copy_filter=copy_filter))
+        dest_files = dict(iter_plugin_files(dest_root, copy_filter=copy_filter)) if dest_root.is_dir() else {}
+
+        for rel_path, src_stat in src_files.items():
+            dest_stat = dest_files.get(rel_path)
+            src_file = src_root / rel_path
+            dest_file = dest_root / rel_path
+            if dest_stat is not None and is_same_file_state(src_stat, dest_stat):
+                if not compare_hash or hash_file(src_file) == hash_file(dest_file):
+                    summary.unchanged.append(rel_path)
+                    continue
+
+            if dest_stat is None:
+                dest_file.parent.mkdir(parents=True, exist_ok=True)
+                summary.copied.append(rel_path)
+            else:
+                summary.updated.append(rel_path)
+            copy_function(src_file, dest_file)
+            summary.bytes_copied += src_stat.st_size
+
+        if delete_removed:
+            for rel_path in dest_files.keys() - src_files.keys():
+                (dest_root / rel_path).unlink()
+                summary.deleted.append(rel_path)
+            if summary.deleted:
+                remove_orphaned_dirs(dest_root=dest_root, src_root=src_root)
+            summary.deleted.sort()
+
+        metrics.bytes_copied = summary.bytes_copied
+        metrics.files_touched = len(summary.copied) + len(summary.updated) + len(summary.deleted)
+        metrics.stats_issued = len(src_files) + len(dest_files)
+        return summary
+
+
+def sync_ue_plugin_files(unreal_plugin_path: os.PathLike, dest_path: os.PathLike, rel_paths: Sequence[str],
+                         copy_filter: Optional[PluginCopyFilter] = None,
+                         backend: CopyBackend = CopyBackend.COPY) -> PluginSyncSummary:
+    # Like sync_ue_plugin but only looks at the given relative paths, e.g. the ones a file watcher reported
+    copy_function = copy_function_for_backend(backend)
+    copy_filter = copy_filter if copy_filter is not None else PLUGIN_COPY_FILTER_ALL
+    src_root = Path(unreal_plugin_path)
+    dest_root = Path(dest_path)
+    summary = PluginSyncSummary()
+    with track_phase("sync_ue_plugin_files", plugin=src_root.name) as metrics:
+        for rel_path in sorted(set(rel_paths)):
+            if not copy_filter.accepts(rel_path):
+                continue
+            src_file = src_root / rel_path
+            dest_file = dest_root / rel_path
+            try:
+                src_stat = src_file.stat()
+            except FileNotFoundError:
+                src_stat = None
+            try:
+                dest_stat = dest_file.stat()
+            except FileNotFoundError:
+                dest_stat = None
+            metrics.stats_issued += 2
+
+            if src_stat is None or not os.path.isfile(src_file):
+                if dest_stat is not None and dest_file.is_file():
+                    dest_file.unlink()
+                    summary.deleted.append(rel_path)
+                continue
+            if dest_stat is not None and is_same_file_state(src_stat, dest_stat):
+                summary.unchanged.append(rel_path)
+                continue
+            if dest_stat is None:
+                dest_file.parent.mkdir(parents=True, exist_ok=True)
+                summary.copied.append(rel_path)
+            else:
+                summary.updated.append(rel_path)
+            copy_function(src_file, dest_file)
+            summary.bytes_copied += src_stat.st_size
+
+        if summary.deleted:
+            remove_orphaned_dirs(dest_root=dest_root, src_root=src_root)
+        metrics.bytes_copied = summary.bytes_copied
+        metrics.files_touched = len(summary.copied) + len(summary.updated) + len(summary.deleted)
+    return summary
+
+
+def plugin_staging_folder(dest_root: Path) -> Path:
+    # <Project or Engine>/Intermediate/Ditto/<Plugins folder path>: on the same volume as dest_root so the swap
+    # is a rename, but outside the Plugins tree so editors and discovery never pick up a half staged .uplugin
+    parts = dest_root.parts
+    plugins_indices = [index for index, part in enumerate(parts[:-1]) if part == UE_PLUGINS_FOLDER_NAME]
+    anchor_index = plugins_indices[-1] if plugins_indices else len(parts) - 1
+    return Path(*parts[:anchor_index], UE_INTERMEDIATE_FOLDER_NAME, PLUGIN_STAGING_FOLDER_NAME,
+                *parts[anchor_index:-1])
+
+
+def transaction_paths(dest_root: Path) -> tuple[Path, Path, Path]:
+    # (staging folder, progress journal, previous copy during the swap)
+    staging_folder = plugin_staging_folder(dest_root)
+    return (staging_folder / f"{dest_root.name}{PLUGIN_STAGING_SUFFIX}",
+            staging_folder / f"{dest_root.name}{PLUGIN_JOURNAL_SUFFIX}",
+            staging_folder / f"{dest_root.name}{PLUGIN_SWAP_SUFFIX}")
+
+
+def read_copy_journal(journal_path: Path) -> dict[str, tuple[int, int]]:
+    finished = {}
+    try:
+        with open(journal_path, "r") as journal:
+            for line in journal:
+                try:
+                    rel_path, size, mtime_ns = json.loads(line)
+                except (ValueError, TypeError):
+                    continue  # torn last line of an interrupted run
+                finished[rel_path] = (size, mtime_ns)
+    except FileNotFoundError:
+        pass
+    return finished
+
+
+def exchange_paths(first: Path, second: Path) -> bool:
+    # Atomically swaps two existing paths with renameat2(RENAME_EXCHANGE) where the OS supports it
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
+    result = renameat2(AT_FDCWD, os.fsencode(first), AT_FDCWD, os.fsencode(second), RENAME_EXCHANGE)
+    return result == 0
+
+
+def swap_in_staged_plugin(staging_path: Path, dest_root: Path, swap_path: Path, journal_path: Path) -> None:
+    # The journal describes the staged files, so it is retired as soon as they are live. Otherwise an
+    # interrupted cleanup would leave the old copy at staging_path with a journal marking it as complete.
+    if not dest_root.exists():
+        os.rename(staging_path, dest_root)
+        journal_path.unlink()
+        return
+    if exchange_paths(staging_path, dest_root):
+        journal_path.unlink()
+        shutil.rmtree(staging_path)
+        return
+    # Two renames: for a moment dest_root is missing, but it is never half written.
+    # A crash in between is repaired by recover_interrupted_swap().
+    os.rename(dest_root, swap_path)
+    os.rename(staging_path, dest_root)
+    journal_path.unlink()
+    shutil.rmtree(swap_path)
+
+
+def recover_interrupted_swap(dest_root: Path, swap_path: Path) -> None:
+    if swap_path.exists():
+        if not dest_root.exists():
+            os.rename(swap_path, dest_root)
+        else:
+            shutil.rmtree(swap_path)
+
+
+def copy_ue_plugin_atomic(unreal_plugin: UnrealPlugin, dest_path: os.PathLike,
+                          backend: CopyBackend = CopyBackend.COPY, seed_from_dest: bool = True) -> Path:
+    # Copies into a staging folder (see plugin_staging_folder) and swaps it in as <dest_path>/<plugin name>
+    # once complete, so editors never see a torn plugin. Every finished file is appended to a journal so an interrupted
+    # copy resumes where it stopped. With seed_from_dest, files already up to date in the current copy
+    # are hardlinked into the staging folder instead of being copied again.
+    dest_root = Path(dest_path) / unreal_plugin.name
+    staging_path, journal_path, swap_path = transaction_paths(dest_root)
+    copy_function = copy_function_for_backend(backend)
+    recover_interrupted_swap(dest_root, swap_path)
+
+    if not journal_path.exists() and staging_path.exists():
+        shutil.rmtree(staging_path)  # leftovers without a journal can't be trusted
+    finished = read_copy_journal(journal_path)
+    plugin_files = dict(iter_plugin_files(unreal_plugin.root, copy_filter=unreal_plugin.copy_filter))
+
+    with track_phase("copy_ue_plugin_atomic", plugin=unreal_plugin.name) as metrics:
+        staging_path.mkdir(parents=True, exist_ok=True)
+        with open(journal_path, "a") as journal:
+            for index, (rel_path, src_stat) in enumerate(plugin_files.items()):
+                file_state = (src_stat.st_size, src_stat.st_mtime_ns)
+                staged_file = staging_path / rel_path
+                if finished.get(rel_path) == file_state and staged_file.is_file():
+                    continue
+
+                staged_file.parent.mkdir(parents=True, exist_ok=True)
+                dest_file = dest_root / rel_path
+                seeded = False
+                if seed_from_dest:
+                    try:
+                        if is_same_file_state(src_stat, dest_file.stat()):
+                            remove_existing_dest(staged_file)
+                            os.link(dest_file, staged_file)
+                            seeded = True
+                    except OSError:
+                        pass
+                if not seeded:
+                    copy_function(unreal_plugin.root / rel_path, staged_file)
+                    metrics.bytes_copied += src_stat.st_size
+                metrics.files_touched += 1
+
+                journal.write(json.dumps([rel_path, *file_state]) + "\n")
+                journal.flush()
+                if index % JOURNAL_FSYNC_INTERVAL == 0:
+                    os.fsync(journal.fileno())
+        metrics.stats_issued = len(plugin_files)
+
+        # Files staged by an earlier run that are no longer part of the plugin
+        for rel_path, _ in list(iter_plugin_files(staging_path)):
+            if rel_path not in plugin_files:
+                (staging_path / rel_path).unlink()
+        remove_orphaned_dirs(dest_root=staging_path, src_root=unreal_plugin.root)
+
+        swap_in_staged_plugin(staging_path, dest_root, swap_path, journal_path)
+    return dest_root
+
+
+def read_plugin_pack_index(pack_path: os.PathLike) -> PluginPackIndex:
+    with zipfile.ZipFile(pack_path, "r") as pack:
+        return PluginPackIndex.from_dict(json.loads(pack.read(PLUGIN_PACK_INDEX_NAME)))
+
+
+def pack_ue_plugin(unreal_plugin: UnrealPlugin, pack_path: os.PathLike, compress: bool = True,
+                   base_pack: Optional[os.PathLike] = None) -> PluginPackIndex:
+    # Writes the plugin (honouring its copy filter) as one sequential zip stream plus an index member.
+    # With base_pack, files whose contents are already in that pack are only referenced, so the receiver
+    # needs the base pack too (see unpack_ue_plugin).
+    base_paths_by_hash = {}
+    if base_pack is not None:
+        base_index = read_plugin_pack_index(base_pack)
+        base_paths_by_hash = {entry.hash: rel_path for rel_path, entry in base_index.files.items()
+                              if entry.base_path is None}
+    index = PluginPackIndex(name=unreal_plugin.name, version=unreal_plugin.version)
+    plugin_files = list(iter_plugin_files(unreal_plugin.root, copy_filter=unreal_plugin.copy_filter))
+
+    with track_phase("pack_ue_plugin", plugin=unreal_plugin.name) as metrics, \
+            zipfile.ZipFile(pack_path, "w", allowZip64=True) as pack:
+        for rel_path, src_stat in plugin_files:
+            src_file = unreal_plugin.root / rel_path
+            if base_paths_by_hash:
+                file_hash = hash_file(src_file)
+                base_path = base_paths_by_hash.get(file_hash)
+                if base_path is not None:
+                    index.files[rel_path] = PluginPackEntry(size=src_stat.st_size, mtime_ns=src_stat.st_mtime_ns,
+                                                            hash=file_hash, base_path=base_path)
+                    continue
+
+            ext = rel_path.rsplit(".", 1)[-1].lower()
+            compress_type = (zipfile.ZIP_DEFLATED if compress and ext not in PLUGIN_PACK_STORED_EXTS
+                             else zipfile.ZIP_STORED)
+            member_info = zipfile.ZipInfo.from_file(src_file, arcname=rel_path)
+            member_info.compress_type = compress_type
+            file_hash = hashlib.blake2b(digest_size=20)
+            # Hash while streaming so every source byte is read exactly once
+            with open(src_file, "rb") as src, pack.open(member_info, "w", force_zip64=True) as member:
+                while chunk := src.read(COPY_CHUNK_SIZE):
+                    file_hash.update(chunk)
+                    member.write(chunk)
+            index.files[rel_path] = PluginPackEntry(size=src_stat.st_size, mtime_ns=src_stat.st_mtime_ns,
+                                                    hash=file_hash.hexdigest())
+            metrics.bytes_copied += src_stat.st_size
+            metrics.files_touched += 1
+        pack.writestr(PLUGIN_PACK_INDEX_NAME, json.dumps(index.to_dict(), separators=(",", ":")),
+                      compress_type=zipfile.ZIP_DEFLATED)
+        metrics.stats_issued = len(plugin_files)
+    return index
+
+
+def unpack_ue_plugin(pack_path: os.PathLike, dest_path: os.PathLike, base_pack: Optional[os.PathLike] = None,
+                     max_workers: Optional[int] = None) -> Path:
+    # Extracts a pack into dest_path (the plugin folder itself) on a thread pool,
+    # every worker reading through its own handle to the pack
+    dest_root = Path(dest_path)
+    index = read_plugin_pack_index(pack_path)
+    if base_pack is None and any(entry.base_path is not None for entry in index.files.values()):
+        raise ValueError(f"{pack_path} is a delta pack, the base pack it was made against is needed")
+    # Packs come from other machines, nothing in the index may point outside dest_root
+    resolved_root = dest_root.resolve()
+    for rel_path in index.files:
+        dest_file = (dest_root / rel_path).resolve()
+        if (os.path.isabs(rel_path) or "\\" in rel_path or ":" in rel_path or ".." in rel_path.split("/")
+                or dest_file == resolved_root or resolved_root not in dest_file.parents):
+            raise ValueError(f"{pack_path} has an unsafe path in its index: {rel_path!r}")
+    for rel_dir in sorted({Path(rel_path).parent for rel_path in index.files}):
+        (dest_root / rel_dir).mkdir(parents=True, exist_ok=True)
+
+    thread_packs = threading.local()
+    open_packs = []
+    open_packs_lock = threading.Lock()
+
+    def thread_pack(path: os.PathLike) -> zipfile.ZipFile:
+        packs = getattr(thread_packs, "packs", None)
+        if packs is None:
+            packs = thread_packs.packs = {}
+        if path not in packs:
+            packs[path] = zipfile.ZipFile(path, "r")
+            with open_packs_lock:
+                open_packs.append(packs[path])
+        return packs[path]
+
+    def extract(item: tuple[str, PluginPackEntry]) -> None:
+        rel_path, entry = item
+        if entry.base_path is None:
+            pack, member_name = thread_pack(pack_path), rel_path
+        else:
+            pack, member_name = thread_pack(base_pack), entry.base_path
+        dest_file = dest_root / rel_path
+        remove_existing_dest(dest_file)
+        file_hash = hashlib.blake2b(digest_size=20)
+        with pack.open(member_name, "r") as member, open(dest_file, "wb") as dest:
+            while chunk := member.read(COPY_CHUNK_SIZE):
+                file_hash.update(chunk)
+                dest.write(chunk)
+        if file_hash.hexdigest() != entry.hash:
+            raise PluginVerificationError(f"{rel_path} in {pack_path} doesn't match its index hash")
+        os.utime(dest_file, ns=(entry.mtime_ns, entry.mtime_ns))
+
+    with track_phase("unpack_ue_plugin", plugin=index.name) as metrics:
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(extract, index.files.items()))
+        finally:
+            for pack in open_packs:
+                pack.close()
+        metrics.files_touched = len(index.files)
+        metrics.bytes_copied = sum(entry.size for entry in index.files.values())
+    return dest_root
+
+
+def build_plugin_copy_plan(unreal_plugins: Sequence[UnrealPlugin], dest_path: os.PathLike,
+                           overwrite_files: bool) -> PluginCopyPlan:
+    # dest_path is the "Plugins" folder that each plugin is copied into, e.g. <Project>/Plugins
+    plan = PluginCopyPlan()
+    for unreal_plugin in unreal_plugins:
+        dest_root = Path(dest_path) / unreal_plugin.name
+        if not overwrite_files and dest_root.exists():
+            raise FileExistsError(f"Plugin destination already exists: {dest_root}")
+        plan.dest_roots.append(dest_root)
+        plan.dest_dirs.add(dest_root)
+        for rel_path, src_stat in iter_plugin_files(unreal_plugin.root, copy_filter=unreal_plugin.copy_filter):
+            dest_file = dest_root / rel_path
+            plan.dest_dirs.add(dest_file.parent)
+            plan.tasks.append(PluginCopyTask(src=unreal_plugin.root / rel_path, dest=dest_file,
+                                             size=src_stat.st_size))
+    # Largest files first so a single huge file doesn't end up being the last one running
+    plan.tasks.sort(key=lambda task: task.size, reverse=True)
+    return plan
+
+
+def run_plugin_copy_plan(plan: PluginCopyPlan, max_workers: Optional[int] = None,
+                         backend: CopyBackend = CopyBackend.COPY) -> list[Path]:
+    copy_function = copy_function_for_backend(backend)
+    for dest_dir in sorted(plan.dest_dirs):
+        dest_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() so that the first failed copy is raised here
+        list(executor.map(lambda task: copy_function(task.src, task.dest), plan.tasks))
+    return plan.dest_roots
+
+
+def copy_ue_plugins(unreal_plugins: Sequence[UnrealPlugin], dest_path: os.PathLike,
+                    overwrite_files: bool, max_workers: Optional[int] = None,
+                    backend: CopyBackend = CopyBackend.COPY) -> list[Path]:
+    with track_phase("copy_ue_plugins") as metrics:
+        plan = build_plugin_copy_plan(unreal_plugins=unreal_plugins, dest_path=dest_path,
+                                      overwrite_files=overwrite_files)
+        metrics.stats_issued = len(plan.tasks)
+        dest_roots = run_plugin_copy_plan(plan=plan, max_workers=max_workers, backend=backend)
+        metrics.bytes_copied = plan.total_bytes
+        metrics.files_touched = len(plan.tasks)
+        return dest_roots
+
+
+def fan_out_file(src_file: Path, rel_path: str, results: dict[Path, FanOutResult],
+                 results_lock: threading.Lock) -> None:
+    dest_files = {}
+    try:
+        with open(src_file, "rb") as src:
+            for dest_root, result in results.items():
+                if result.errors and result.errors[0][0] == "":
+                    continue  # destination failed as a whole
+                try:
+                    remove_existing_dest(dest_root / rel_path)
+                    dest_files[dest_root] = open(dest_root / rel_path, "wb")
+                except OSError as error:
+                    with results_lock:
+                        result.errors.append((rel_path, str(error)))
+
+            # Each chunk is read once and written to every destination that is still healthy
+            while dest_files and (chunk := src.read(COPY_CHUNK_SIZE)):
+                for dest_root, dest in list(dest_files.items()):
+                    try:
+                        dest.write(chunk)
+                    except OSError as error:
+                        dest.close()
+                        del dest_files[dest_root]
+                        with results_lock:
+                            results[dest_root].errors.append((rel_path, str(error)))
+    finally:
+        for dest in dest_files.values():
+            dest.close()
+
+    for dest_root in dest_files:
+        dest_file = dest_root / rel_path
+        try:
+            shutil.copystat(src_file, dest_file)
+        except OSError as error:
+            with results_lock:
+                results[dest_root].errors.append((rel_path, str(error)))
+            continue
+        with results_lock:
+            results[dest_root].files_written += 1
+            results[dest_root].bytes_written += dest_file.stat().st_size
+
+
+def fan_out_ue_plugin(unreal_plugin: UnrealPlugin, dest_paths: Sequence[os.PathLike], overwrite_files: bool,
+                      max_workers: Optional[int] = None) -> dict[Path, FanOutResult]:
+    # dest_paths are "Plugins" folders (engine or project), the plugin is written to <dest_path>/<plugin name>.
+    # A failing destination never stops the others, its errors are collected in its FanOutResult.
+    results = {Path(dest_path) / unreal_plugin.name: FanOutResult(dest_path=Path(dest_path) / unreal_plugin.name)
+               for dest_path in dest_paths}
+    results_lock = threading.Lock()
+    plugin_files = list(iter_plugin_files(unreal_plugin.root, copy_filter=unreal_plugin.copy_filter))
+    rel_dirs = sorted({Path(rel_path).parent for rel_path, _ in plugin_files})
+
+    for dest_root, result in results.items():
+        try:
+            if not overwrite_files and dest_root.exists():
+                raise FileExistsError(f"Plugin destination already exists: {dest_root}")
+            for rel_dir in rel_dirs:
+                (dest_root / rel_dir).mkdir(parents=True, exist_ok=True)
+        except OSError as error:
+            result.errors.append(("", str(error)))
+
+    with track_phase("fan_out_ue_plugin", plugin=unreal_plugin.name) as metrics:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda item: fan_out_file(src_file=unreal_plugin.root / item[0], rel_path=item[0],
+                                                        results=results, results_lock=results_lock),
+                              plugin_files))
+        metrics.stats_issued = len(plugin_files)
+        for result in results.values():
+            metrics.bytes_copied += result.bytes_written
+            metrics.files_touched += result.files_written
+            metrics.errors.extend(f"{result.dest_path}/{rel_path}: {error}" for rel_path, error in result.errors)
+    return results
+
+
+def verify_ue_plugin_copy(unreal_plugin: UnrealPlugin, dest_path: os.PathLike) -> None:
+    dest_root = Path(dest_path)
+    mismatched = []
+    for rel_path, src_stat in iter_plugin_files(unreal_plugin.root, copy_filter=unreal_plugin.copy_filter):
+        try:
+            dest_size = (dest_root / rel_path).stat().st_size
+        except FileNotFoundError:
+            mismatched.append(rel_path)
+            continue
+        if dest_size != src_stat.st_size:
+            mismatched.append(rel_path)
+    if mismatched:
+        raise PluginVerificationError(f"{len(mismatched)} file(s) missing or different in {dest_root}: "
+                                      f"{', '.join(mismatched[:10])}")
+
+
+# Marks the end of the stream between pipeline stages
+PIPELINE_END = object()
+
+
+def pipeline_put(stage_queue: queue.Queue, item, stop_event: threading.Event) -> bool:
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=PIPELINE_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def pipeline_get(stage_queue: queue.Queue, stop_event: threading.Event):
+    while not stop_event.is_set():
+        try:
+            return stage_queue.get(timeout=PIPELINE_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+    return PIPELINE_END
+
+
+def pipeline_stage(stage_name: str, stage_func: Callable[[PluginPipelineResult], bool],
+                   in_queue: queue.Queue, out_queue: queue.Queue, stop_event: threading.Event) -> None:
+    # stage_func returns False to drop an item (e.g. a plugin that wasn't selected).
+    # Items that already failed upstream are passed through untouched.
+    # The end marker is always sent on, otherwise the stages downstream wait for it forever.
+    try:
+        while (item := pipeline_get(in_queue, stop_event)) is not PIPELINE_END:
+            if item.error is None:
+                try:
+                    if not stage_func(item):
+                        continue
+                except Exception as error:
+                    item.error = error
+                    item.failed_stage = stage_name
+            if not pipeline_put(out_queue, item, stop_event):
+                return
+    finally:
+        pipeline_put(out_queue, PIPELINE_END, stop_event)
+
+
+def run_plugin_pipeline(unreal_install_paths: Sequence[Path], dest_path: os.PathLike,
+                        select: Optional[Callable[[UnrealPlugin], bool]] = None, overwrite_files: bool = True,
+                        verify: bool = True, stop_on_error: bool = False, queue_size: int = PIPELINE_QUEUE_SIZE,
+                        max_workers: Optional[int] = None,
+                        backend: CopyBackend = CopyBackend.COPY) -> Iterator[PluginPipelineResult]:
+    # discovery -> metadata/select -> copy -> verify, each stage on its own thread with bounded queues
+    # in between, so the first plugin is being copied while later ones are still being discovered.
+    # Results are yielded as each plugin leaves the last stage.
+    stop_event = threading.Event()
+    discovered, selected, copied, finished = (queue.Queue(maxsize=queue_size) for _ in range(4))
+
+    def discover() -> None:
+        try:
+            for unreal_install_path in unreal_install_paths:
+                try:
+                    for unreal_plugin in iter_ue_marketplace_plugins(unreal_install_path):
+                        if not pipeline_put(discovered, PluginPipelineResult(plugin=unreal_plugin), stop_event):
+                            return
+                except Exception as error:
+                    if not pipeline_put(discovered, PluginPipelineResult(plugin=None, error=error,
+                                                                         failed_stage="discover"), stop_event):
+                        return
+        finally:
+            pipeline_put(discovered, PIPELINE_END, stop_event)
+
+    def select_plugin(item: PluginPipelineResult) -> bool:
+        item.plugin.metadata  # parse the .uplugin here rather than in the copy stage
+        return select is None or select(item.plugin)
+
+    def copy_plugin(item: PluginPipelineResult) -> bool:
+        item.dest_path, = copy_ue_plugins(unreal_plugins=(item.plugin,), dest_path=dest_path,
+                                          overwrite_files=overwrite_files, max_workers=max_workers,
+                                          backend=backend)
+        item.copied = True
+        return True
+
+    def verify_plugin(item: PluginPipelineResult) -> bool:
+        if verify:
+            verify_ue_plugin_copy(item.plugin, item.dest_path)
+            item.verified = True
+        return True
+
+    threads = [
+        threading.Thread(target=discover, daemon=True),
+        threading.Thread(target=pipeline_stage, args=("select", select_plugin, discovered, selected, stop_event),
+                         daemon=True),
+        threading.Thread(target=pipeline_stage, args=("copy", copy_plugin, selected, copied, stop_event),
+                         daemon=True),
+        threading.Thread(target=pipeline_stage, args=("verify", verify_plugin, copied, finished, stop_event),
+                         daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while (item := pipeline_get(finished, stop_event)) is not PIPELINE_END:
+            if item.error is not None and stop_on_error:
+                stop_event.set()
+            yield item
+            if stop_event.is_set():
+                return
+    finally:
+        # Also reached when the caller stops iterating early
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+
+def folder_manifest_path(folder_path: Path) -> Path:
+    # Sidecar next to the folder, e.g. Engine/Plugins/Marketplace/<PluginFolder>.ditto-manifest.json
+    return folder_path.parent / f"{folder_path.name}{PLUGIN_MANIFEST_SUFFIX}"
+
+
+def plugin_manifest_path(unreal_plugin: UnrealPlugin) -> Path:
+    return folder_manifest_path(unreal_plugin.root)
+
+
+def load_plugin_manifest(manifest_path: os.PathLike) -> Optional[PluginManifest]:
+    try:
+        with open(manifest_path, "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if data.get("FormatVersion") != PLUGIN_MANIFEST_FORMAT_VERSION:
+        return None
+    return PluginManifest.from_dict(data)
+
+
+def save_plugin_manifest(manifest: PluginManifest, manifest_path: os.PathLike) -> None:
+    # Write to a temporary file first so a crash never leaves a truncated manifest behind
+    temp_path = f"{os.fspath(manifest_path)}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest.to_dict(), fp=f, separators=(",", ":"))
+    os.replace(temp_path, manifest_path)
+
+
+def build_plugin_manifest(unreal_plugin: UnrealPlugin, previous: Optional[PluginManifest] = None,
+                          max_workers: Optional[int] = None,
+                          copy_filter: Optional[PluginCopyFilter] = None) -> PluginManifest:
+    previous_files = previous.files if previous is not None else {}
+    manifest = PluginManifest(name=unreal_plugin.name, version=unreal_plugin.version)
+
+    # Only files whose size or mtime moved since the previous manifest get re-hashed
+    to_hash: list[tuple[str, os.stat_result]] = []
+    for rel_path, file_stat in iter_plugin_files(unreal_plugin.root, copy_filter=copy_filter):
+        previous_entry = previous_files.get(rel_path)
+        if (previous_entry is not None and previous_entry.size == file_stat.st_size
+                and previous_entry.mtime_ns == file_stat.st_mtime_ns):
+            manifest.files[rel_path] = previous_entry
+        else:
+            to_hash.append((rel_path, file_stat))
+
+    with track_phase("build_plugin_manifest", plugin=unreal_plugin.name) as metrics:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            file_hashes = executor.map(lambda item: hash_file(unreal_plugin.root / item[0]), to_hash)
+            for (rel_path, file_stat), file_hash in zip(to_hash, file_hashes):
+                manifest.files[rel_path] = PluginManifestEntry(size=file_stat.st_size,
+                                                               mtime_ns=file_stat.st_mtime_ns, hash=file_hash)
+        metrics.files_touched = len(to_hash)
+        metrics.stats_issued = len(manifest.files)
+    return manifest
+
+
+def diff_plugin_manifests(previous: Optional[PluginManifest], current: PluginManifest) -> PluginManifestChanges:
+    previous_files = previous.files if previous is not None else {}
+    changes = PluginManifestChanges(name=current.name, version=current.version,
+                                    previous_version=previous.version if previous is not None else None)
+    for rel_path, entry in current.files.items():
+        previous_entry = previous_files.get(rel_path)
+        if previous_entry is None:
+            changes.added.append(rel_path)
+        elif previous_entry.hash != entry.hash:
+            changes.modified.append(rel_path)
+    changes.removed.extend(previous_files.keys() - current.files.keys())
+    changes.added.sort()
+    changes.modified.sort()
+    changes.removed.sort()
+    return changes
+
+
+def record_plugin_baseline(unreal_plugin: UnrealPlugin, project_plugin_path: Path,
+                           max_workers: Optional[int] = None) -> PluginManifest:
+    # Remembers what was copied into <Project>/Plugins/<Name> so that later diffs can tell
+    # upstream changes apart from local edits.
+    project_plugin = UnrealPlugin(plugin_file=project_plugin_path / unreal_plugin.plugin_file.name,
+                                  copy_filter=unreal_plugin.copy_filter)
+    baseline = build_plugin_manifest(project_plugin, max_workers=max_workers)
+    save_plugin_manifest(baseline, folder_manifest_path(project_plugin_path))
+    return baseline
+
+
+def diff_ue_plugin(unreal_plugin: UnrealPlugin, project_plugin_path: Path,
+                   baseline: Optional[PluginManifest] = None, max_workers: Optional[int] = None) -> PluginDiff:
+    # Compares <Project>/Plugins/<Name> against the launcher plugin.
+    # Files that match on size and mtime are never read. Only the remaining candidates are hashed, on a pool.
+    # Without a baseline (see record_plugin_baseline) a file that differs on both sides is attributed to
+    # whichever side has the newer mtime.
+    if baseline is None:
+        baseline = load_plugin_manifest(folder_manifest_path(project_plugin_path))
+    baseline_files = baseline.files if baseline is not None else {}
+    copy_filter = unreal_plugin.copy_filter
+    src_files = dict(iter_plugin_files(unreal_plugin.root, copy_filter=copy_filter))
+    local_files = (dict(iter_plugin_files(project_plugin_path, copy_filter=copy_filter))
+                   if project_plugin_path.is_dir() else {})
+    plugin_diff = PluginDiff(name=unreal_plugin.name)
+
+    candidates = []
+    for rel_path in sorted(src_files.keys() | local_files.keys() | baseline_files.keys()):
+        src_stat = src_files.get(rel_path)
+        local_stat = local_files.get(rel_path)
+        if src_stat is not None and local_stat is not None and is_same_file_state(src_stat, local_stat):
+            plugin_diff.unchanged.append(rel_path)
+        elif src_stat is not None or local_stat is not None:
+            candidates.append(rel_path)
+
+    def known_hash(rel_path: str, file_stat: Optional[os.stat_result]) -> Optional[str]:
+        baseline_entry = baseline_files.get(rel_path)
+        if (file_stat is not None and baseline_entry is not None and baseline_entry.size == file_stat.st_size
+                and baseline_entry.mtime_ns == file_stat.st_mtime_ns):
+            return baseline_entry.hash
+        return None
+
+    to_hash = []
+    for rel_path in candidates:
+        src_stat = src_files.get(rel_path)
+        local_stat = local_files.get(rel_path)
+        if baseline is None and (src_stat is None or local_stat is None or src_stat.st_size != local_stat.st_size):
+            continue  # already known to differ, and there is no baseline to compare against
+        for root, file_stat in ((unreal_plugin.root, src_stat), (project_plugin_path, local_stat)):
+            if file_stat is not None and known_hash(rel_path, file_stat) is None:
+                to_hash.append(root / rel_path)
+
+    with track_phase("diff_ue_plugin", plugin=unreal_plugin.name) as metrics:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            file_hashes = dict(zip(to_hash, executor.map(hash_file, to_hash)))
+        metrics.files_touched = len(to_hash)
+        metrics.stats_issued = len(src_files) + len(local_files)
+
+    def file_hash(root: Path, rel_path: str, file_stat: Optional[os.stat_result]) -> Optional[str]:
+        if file_stat is None:
+            return None
+        return known_hash(rel_path, file_stat) or file_hashes.get(root / rel_path)
+
+    for rel_path in candidates:
+        src_stat = src_files.get(rel_path)
+        local_stat = local_files.get(rel_path)
+        src_hash = file_hash(unreal_plugin.root, rel_path, src_stat)
+        local_hash = file_hash(project_plugin_path, rel_path, local_stat)
+        if src_hash is not None and src_hash == local_hash:
+            plugin_diff.unchanged.append(rel_path)
+            continue
+
+        if baseline is not None:
+            base_entry = baseline_files.get(rel_path)
+            base_hash = base_entry.hash if base_entry is not None else None
+            upstream_changed = src_hash != base_hash
+            locally_modified = local_hash != base_hash
+        elif local_stat is None:
+            upstream_changed, locally_modified = True, False
+        elif src_stat is None:
+            upstream_changed, locally_modified = False, True
+        else:
+            locally_modified = local_stat.st_mtime_ns > src_stat.st_mtime_ns
+            upstream_changed = not locally_modified
+
+        if upstream_changed and locally_modified:
+            plugin_diff.both_changed.append(rel_path)
+        elif locally_modified:
+            plugin_diff.locally_modified.append(rel_path)
+        else:
+            plugin_diff.upstream_changed.append(rel_path)
+
+    plugin_diff.unchanged.sort()
+    return plugin_diff
+
+
+def apply_upstream_changes(unreal_plugin: UnrealPlugin, project_plugin_path: Path, plugin_diff: PluginDiff,
+                           merge_stage_path: Optional[Path] = None) -> None:
+    # Copies/removes upstream_changed files and leaves local edits alone.
+    # Upstream versions of both_changed files are put into merge_stage_path (if given) for a merge tool.
+    for rel_path in plugin_diff.upstream_changed:
+        src_file = unreal_plugin.root / rel_path
+        local_file = project_plugin_path / rel_path
+        if src_file.is_file():
+            local_file.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(src_file, local_file)
+        elif local_file.is_file():
+            local_file.unlink()
+
+    if merge_stage_path is not None:
+        for rel_path in plugin_diff.both_changed:
+            src_file = unreal_plugin.root / rel_path
+            if src_file.is_file():
+                (merge_stage_path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(src_file, merge_stage_path / rel_path)
+
+
+class PluginStore:
+    # Content addressed store of plugin files shared by every engine version and project.
+    #   objects/<hash[:2]>/<hash[2:]>   file contents, stored once per unique hash
+    #   trees/<plugin name>/<version>/<tree id>.json   PluginManifest of one ingested plugin tree
+    #   sources/<source id>.json   last manifest built from one plugin folder, only used to skip re-hashing
+    # The tree id is a hash of the tree's contents, as the same plugin Version usually ships different
+    # Binaries for every engine version it's installed in.
+    # Materializing links or clones objects into place. Anything written through a hardlink changes
+    # the stored object too, verify() reports such objects as corrupt.
+
+    def __init__(self, root: os.PathLike):
+        self.root = Path(root)
+        self.objects_path = self.root / PLUGIN_STORE_OBJECTS_FOLDER_NAME
+        self.trees_path = self.root / PLUGIN_STORE_TREES_FOLDER_NAME
+        self.sources_path = self.root / PLUGIN_STORE_SOURCES_FOLDER_NAME
+
+    @staticmethod
+    def tree_id(tree: PluginManifest) -> str:
+        tree_hash = hashlib.blake2b(digest_size=16)
+        for rel_path, entry in sorted(tree.files.items()):
+            tree_hash.update(f"{rel_path}\0{entry.hash}\n".encode())
+        return tree_hash.hexdigest()
+
+    def object_path(self, file_hash: str) -> Path:
+        return self.objects_path / file_hash[:2] / file_hash[2:]
+
+    def tree_path(self, name: str, version: str, tree_id: str) -> Path:
+        return self.trees_path / name / version / f"{tree_id}.json"
+
+    def source_path(self, unreal_plugin: UnrealPlugin) -> Path:
+        source_id = hashlib.blake2b(os.fsencode(unreal_plugin.plugin_file.absolute()), digest_size=16).hexdigest()
+        return self.sources_path / f"{source_id}.json"
+
+    def trees(self) -> list[tuple[str, str, str]]:
+        return sorted((tree_file.parent.parent.name, tree_file.parent.name, tree_file.stem)
+                      for tree_file in self.trees_path.glob("*/*/*.json"))
+
+    def load_tree(self, name: str, version: str, tree_id: str) -> PluginManifest:
+        tree = load_plugin_manifest(self.tree_path(name, version, tree_id))
+        if tree is None:
+            raise FileNotFoundError(f"Plugin {name} version {version} tree {tree_id} is not in the store {self.root}")
+        return tree
+
+    def remove_tree(self, name: str, version: str, tree_id: str) -> None:
+        self.tree_path(name, version, tree_id).unlink()
+
+    def add_object(self, src_file: Path, file_hash: str) -> bool:
+        object_path = self.object_path(file_hash)
+        if object_path.exists():
+            return False
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        # Copy under a unique temporary name first so concurrent ingests never expose a partial object
+        temp_path = object_path.with_name(f"{object_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copy2(src_file, temp_path)
+        os.replace(temp_path, object_path)
+        return True
+
+    def ingest(self, unreal_plugin: UnrealPlugin, max_workers: Optional[int] = None) -> PluginManifest:
+        source_path = self.source_path(unreal_plugin)
+        # Re-ingesting an unchanged plugin folder only costs a stat per file thanks to its previous manifest
+        tree = build_plugin_manifest(unreal_plugin, previous=load_plugin_manifest(source_path),
+                                     max_workers=max_workers)
+        tree_path = self.tree_path(unreal_plugin.name, unreal_plugin.version, self.tree_id(tree))
+        with track_phase("store_ingest", plugin=unreal_plugin.name) as metrics:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                added = executor.map(lambda item: self.add_object(unreal_plugin.root / item[0], item[1].hash),
+                                     tree.files.items())
+                for (rel_path, entry), was_added in zip(tree.files.items(), added):
+                    if was_added:
+                        metrics.files_touched += 1
+                        metrics.bytes_copied += entry.size
+        tree_path.parent.mkdir(parents=True, exist_ok=True)
+        save_plugin_manifest(tree, tree_path)
+        source_path.parent.mkdir(parents=True, exist_ok=True)
+        save_plugin_manifest(tree, source_path)
+        return tree
+
+    def ingest_install(self, unreal_install_path: Path, max_workers: Optional[int] = None) -> list[PluginManifest]:
+        return [self.ingest(unreal_plugin, max_workers=max_workers)
+                for unreal_plugin in ue_marketplace_plugins(unreal_install_path)]
+
+    def materialize(self, name: str, version: str, tree_id: str, dest_path: Path,
+                    copy_filter: Optional[PluginCopyFilter] = None, backend: CopyBackend = CopyBackend.REFLINK,
+                    max_workers: Optional[int] = None) -> Path:
+        tree = self.load_tree(name, version, tree_id)
+        copy_function = copy_function_for_backend(backend)
+        rel_paths = [rel_path for rel_path in tree.files
+                     if copy_filter is None or copy_filter.accepts(rel_path)]
+        for rel_dir in sorted({Path(rel_path).parent for rel_path in rel_paths}):
+            (dest_path / rel_dir).mkdir(parents=True, exist_ok=True)
+        with track_phase("store_materialize", plugin=name) as metrics:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(lambda rel_path: copy_function(self.object_path(tree.files[rel_path].hash),
+                                                                 dest_path / rel_path),
+                                  rel_paths))
+            metrics.files_touched = len(rel_paths)
+            metrics.bytes_copied = sum(tree.files[rel_path].size for rel_path in rel_paths)
+        return dest_path
+
+    def referenced_hashes(self) -> set[str]:
+        return {entry.hash for name, version, tree_id in self.trees()
+                for entry in self.load_tree(name, version, tree_id).files.values()}
+
+    def iter_objects(self) -> Iterator[tuple[str, Path]]:
+        if not self.objects_path.is_dir():
+            return
+        for prefix_dir in self.objects_path.iterdir():
+            for object_path in prefix_dir.iterdir():
+                if not object_path.name.endswith(".tmp"):
+                    yield f"{prefix_dir.name}{object_path.name}", object_path
+
+    def collect_garbage(self) -> PluginStoreCollection:
+        referenced = self.referenced_hashes()
+        collection = PluginStoreCollection()
+        for file_hash, object_path in list(self.iter_objects()):
+            if file_hash in referenced:
+                continue
+            collection.freed_bytes += object_path.stat().st_size
+            object_path.unlink()
+            collection.removed_objects += 1
+        return collection
+
+    def verify(self, max_workers: Optional[int] = None) -> PluginStoreCheck:
+        check = PluginStoreCheck()
+        objects = dict(self.iter_objects())
+        check.missing = sorted(self.referenced_hashes() - objects.keys())
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            actual_hashes = executor.map(hash_file, objects.values())
+            check.corrupt = sorted(file_hash for file_hash, actual_hash in zip(objects, actual_hashes)
+                                   if file_hash != actual_hash)
+        return check
+
+
+def check_ue_plugin_updates(unreal_plugins: Sequence[UnrealPlugin], write_manifests: bool = True,
+                            max_workers: Optional[int] = None) -> list[PluginManifestChanges]:
+    updated_plugins = []
+    for unreal_plugin in unreal_plugins:
+        manifest_path = plugin_manifest_path(unreal_plugin)
+        previous = load_plugin_manifest(manifest_path)
+        if previous is not None and previous.name != unreal_plugin.name:
+            previous = None
+        current = build_plugin_manifest(unreal_plugin, previous=previous, max_workers=max_workers)
+        changes = diff_plugin_manifests(previous=previous, current=current)
+        if changes.changed:
+            updated_plugins.append(changes)
+        # Also persist when only size/mtime drifted so touched files aren't re-hashed on every run
+        if write_manifests and (previous is None or changes.changed or current.files != previous.files):
+            save_plugin_manifest(current, manifest_path)
+    return updated_plugins
+
+
+def check_marketplace_plugin_updates(unreal_install_path: Path, write_manifests: bool = True,
+                                     max_workers: Optional[int] = None) -> list[PluginManifestChanges]:
+    return check_ue_plugin_updates(ue_marketplace_plugins(unreal_install_path),
+                                   write_manifests=write_manifests, max_workers=max_workers)
+
+
+def read_modules_build_id(modules_path: Path) -> Optional[str]:
+    try:
+        with open(modules_path, "r", encoding="utf-8-sig") as f:
+            return str(json.load(f)["BuildId"])
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+
+def engine_build_id(unreal_install_path: Path) -> Optional[str]:
+    return read_modules_build_id(unreal_install_path / UE_ENGINE_FOLDER_NAME / UE_BINARIES_FOLDER_NAME
+                                 / UE_PLATFORM_WINDOWS_NAME / UE_ENGINE_EDITOR_MODULES_FILE_NAME)
+
+
+def plugin_build_state_path(unreal_plugin: UnrealPlugin) -> Path:
+    return unreal_plugin.root.parent / f".{unreal_plugin.root.name}{PLUGIN_BUILD_STATE_SUFFIX}"
+
+
+def plugin_rebuild_reason(unreal_plugin: UnrealPlugin, target_build_id: Optional[str],
+                          max_workers: Optional[int] = None) -> tuple[Optional[str], PluginManifest]:
+    # Returns (why the plugin needs building or None, current Source/* manifest)
+    build_state = load_plugin_manifest(plugin_build_state_path(unreal_plugin))
+    source_manifest = build_plugin_manifest(unreal_plugin, previous=build_state, max_workers=max_workers,
+                                            copy_filter=PLUGIN_COPY_FILTER_SOURCE_ONLY)
+    modules_path = (unreal_plugin.root / UE_BINARIES_FOLDER_NAME / UE_PLATFORM_WINDOWS_NAME
+                    / UE_ENGINE_EDITOR_MODULES_FILE_NAME)
+    try:
+        with open(modules_path, "r", encoding="utf-8-sig") as f:
+            modules_data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return "not built", source_manifest
+
+    if target_build_id is not None and str(modules_data.get("BuildId")) != target_build_id:
+        return f"BuildId {modules_data.get('BuildId')} doesn't match engine BuildId {target_build_id}", source_manifest
+    built_modules = modules_data.get("Modules", {})
+    missing_modules = [module["Name"] for module in unreal_plugin.modules
+                       if module.get("Type") in ("Editor", "Runtime", "Developer", "UncookedOnly")
+                       and module["Name"] not in built_modules]
+    if missing_modules:
+        return f"modules not built: {', '.join(missing_modules)}", source_manifest
+    # Without a build record the shipped binaries are trusted to match the shipped source
+    if build_state is not None and {rel_path: entry.hash for rel_path, entry in build_state.files.items()} != \
+            {rel_path: entry.hash for rel_path, entry in source_manifest.files.items()}:
+        return "source changed", source_manifest
+    return None, source_manifest
+
+
+def build_ue_plugins(unreal_plugins: Sequence[UnrealPlugin], unreal_install_path: Path,
+                     build_command: Sequence[str], max_jobs: int = PLUGIN_BUILD_MAX_JOBS,
+                     force: bool = False) -> list[PluginBuildResult]:
+    # Builds only the plugins whose binaries don't match the engine BuildId or whose Source/* changed
+    # since their last successful build, plus anything that depends on them through .uplugin "Plugins".
+    # Dependencies are built first, independent plugins run concurrently up to max_jobs.
+    # build_command items are formatted with {engine_root}, {plugin_file}, {plugin_root}, {plugin_name}
+    # and {build_id}, e.g. a RunUAT BuildPlugin command line or a stub in tests.
+    target_build_id = engine_build_id(unreal_install_path)
+    plugins_by_name = {unreal_plugin.name: unreal_plugin for unreal_plugin in unreal_plugins}
+    dependencies = {name: {dependency["Name"] for dependency in unreal_plugin.plugin_dependencies
+                           if dependency["Name"] in plugins_by_name and dependency.get("Enabled", True)}
+                    for name, unreal_plugin in plugins_by_name.items()}
+
+    reasons = {}
+    source_manifests = {}
+    for name, unreal_plugin in plugins_by_name.items():
+        reason, source_manifests[name] = plugin_rebuild_reason(unreal_plugin, target_build_id)
+        if reason is None and force:
+            reason = "forced"
+        if reason is not None:
+            reasons[name] = reason
+        elif not plugin_build_state_path(unreal_plugin).exists():
+            save_plugin_manifest(source_manifests[name], plugin_build_state_path(unreal_plugin))
+
+    # Anything depending on a plugin that gets rebuilt has to be rebuilt after it
+    changed = True
+    while changed:
+        changed = False
+        for name, plugin_dependencies in dependencies.items():
+            rebuilt_dependencies = sorted(plugin_dependencies & reasons.keys())
+            if name not in reasons and rebuilt_dependencies:
+                reasons[name] = f"dependency rebuilt: {', '.join(rebuilt_dependencies)}"
+                changed = True
+
+    def run_build(name: str) -> PluginBuildResult:
+        unreal_plugin = plugins_by_name[name]
+        tokens = {"engine_root": os.fspath(unreal_install_path), "plugin_file": os.fspath(unreal_plugin.plugin_file),
+                  "plugin_root": os.fspath(unreal_plugin.root), "plugin_name": name,
+                  "build_id": target_build_id or ""}
+        command = [argument.format(**tokens) for argument in build_command]
+        with track_phase("build_ue_plugin", plugin=name) as metrics:
+            try:
+                process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            except OSError as error:
+                # e.g. a missing or non-executable build tool, reported like any other failed build
+                metrics.errors.append(f"{command[0]}: {error}")
+                return PluginBuildResult(name=name, reason=reasons[name], output=str(error))
+            if process.returncode != 0:
+                metrics.errors.append(f"{command[0]} exited with {process.returncode}")
+        if process.returncode == 0:
+            save_plugin_manifest(source_manifests[name], plugin_build_state_path(unreal_plugin))
+        return PluginBuildResult(name=name, reason=reasons[name], returncode=process.returncode,
+                                 output=process.stdout)
+
+    results = {}
+    pending = set(reasons)
+    running: dict[Future, str] = {}
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        while pending or running:
+            for name in sorted(pending):
+                waiting_on = dependencies[name] & reasons.keys()
+                if any(dependency in results and not results[dependency].ok for dependency in waiting_on):
+                    results[name] = PluginBuildResult(name=name, reason=reasons[name], skipped=True,
+                                                      output="a dependency failed to build")
+                    pending.discard(name)
+                elif all(dependency in results for dependency in waiting_on):
+                    running[executor.submit(run_build, name)] = name
+                    pending.discard(name)
+            if not running:
+                if pending:
+                    raise ValueError(f"Plugin dependency cycle between: {', '.join(sorted(pending))}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return [results[name] for name in plugins_by_name if name in results]
+
+
+def read_unreal_data_file(path: Path) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class UECompatibilityIndex:
+    # SQLite index of what every known engine install and project has: Build.version, the editor .modules
+    # BuildId and the Version/VersionName/BuildId of each plugin. refresh() stats the source files and only
+    # re-parses the ones whose mtime or size changed, queries never touch the engine installs.
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS source_files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)",
+        "CREATE TABLE IF NOT EXISTS engines (root TEXT PRIMARY KEY, major_version INTEGER, minor_version INTEGER,"
+        " patch_version INTEGER, compatible_changelist INTEGER, build_id TEXT)",
+        "CREATE TABLE IF NOT EXISTS projects (root TEXT PRIMARY KEY, engine_association TEXT)",
+        "CREATE TABLE IF NOT EXISTS plugins (plugin_file TEXT PRIMARY KEY, owner_root TEXT NOT NULL,"
+        " name TEXT NOT NULL, version INTEGER, version_name TEXT, build_id TEXT)",
+        "CREATE INDEX IF NOT EXISTS plugins_by_name ON plugins (name, owner_root)",
+        "CREATE INDEX IF NOT EXISTS plugins_by_owner ON plugins (owner_root)",
+    )
+
+    def __init__(self, index_path: os.PathLike):
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != UE_COMPATIBILITY_INDEX_FORMAT_VERSION:
+            with self.connection:
+                for table in ("source_files", "engines", "projects", "plugins"):
+                    self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+                self.connection.execute(f"PRAGMA user_version = {UE_COMPATIBILITY_INDEX_FORMAT_VERSION}")
+        with self.connection:
+            for statement in self.schema:
+                self.connection.execute(statement)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> UECompatibilityIndex:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def changed_source_states(self, paths: Sequence[Path], metrics: PhaseMetrics) -> Optional[dict[Path, tuple]]:
+        # The current (mtime_ns, size) of every path if any of them changed since it was last recorded, else None.
+        # Missing files count as changed once, so removals are picked up as well. Nothing is recorded here,
+        # record_source_states() is only called once the files were parsed successfully.
+        states = {}
+        changed = False
+        for path in paths:
+            metrics.stats_issued += 1
+            try:
+                file_stat = path.stat()
+                states[path] = (file_stat.st_mtime_ns, file_stat.st_size)
+            except FileNotFoundError:
+                states[path] = (None, None)
+            row = self.connection.execute("SELECT mtime_ns, size FROM source_files WHERE path = ?",
+                                          (os.fspath(path),)).fetchone()
+            changed = changed or row is None or tuple(row) != states[path]
+        return states if changed else None
+
+    def record_source_states(self, states: dict[Path, tuple]) -> None:
+        self.connection.executemany("INSERT OR REPLACE INTO source_files VALUES (?, ?, ?)",
+                                    ((os.fspath(path), *state) for path, state in states.items()))
+
+    @staticmethod
+    def read_source(path: Path, state: tuple, metrics: PhaseMetrics) -> Optional[dict]:
+        # {} for a missing file, None for one that can't be parsed (e.g. still being written)
+        if state == (None, None):
+            return {}
+        data = read_unreal_data_file(path)
+        if data is None:
+            metrics.errors.append(f"Can't parse {path}")
+        return data
+
+    def refresh_plugins(self, owner_root: Path, plugin_files: Sequence[Path], metrics: PhaseMetrics) -> None:
+        for plugin_file in plugin_files:
+            modules_path = (plugin_file.parent / UE_BINARIES_FOLDER_NAME / UE_PLATFORM_WINDOWS_NAME
+                            / UE_ENGINE_EDITOR_MODULES_FILE_NAME)
+            states = self.changed_source_states((plugin_file, modules_path), metrics)
+            if states is None:
+                continue
+            plugin_data = self.read_source(plugin_file, states[plugin_file], metrics)
+            modules_data = self.read_source(modules_path, states[modules_path], metrics)
+            try:
+                version = int(plugin_data.get("Version", 1)) if plugin_data else None
+            except (TypeError, ValueError):
+                metrics.errors.append(f"{plugin_file} has an invalid Version")
+                version = None
+            if version is None or modules_data is None:
+                # Leave the recorded states alone so the next refresh parses the files again
+                self.connection.execute("DELETE FROM plugins WHERE plugin_file = ?", (os.fspath(plugin_file),))
+                continue
+            build_id = modules_data.get("BuildId")
+            self.connection.execute("INSERT OR REPLACE INTO plugins VALUES (?, ?, ?, ?, ?, ?)",
+                                    (os.fspath(plugin_file), os.fspath(owner_root), plugin_file.stem, version,
+                                     str(plugin_data.get("VersionName", 0.0)),
+                                     str(build_id) if build_id is not None else None))
+            self.record_source_states(states)
+            metrics.files_touched += 1
+
+        known_plugin_files = {os.fspath(plugin_file) for plugin_file in plugin_files}
+        for (plugin_file,) in self.connection.execute("SELECT plugin_file FROM plugins WHERE owner_root = ?",
+                                                      (os.fspath(owner_root),)).fetchall():
+            if plugin_file not in known_plugin_files:
+                self.connection.execute("DELETE FROM plugins WHERE plugin_file = ?", (plugin_file,))
+
+    def refresh(self, engine_installs: Sequence[Path], projects: Sequence[Path]) -> int:
+        # Engine and project lists usually come from locate_ue_environments(). Returns how many files were parsed.
+        with track_phase("refresh_compatibility_index") as metrics, self.connection:
+            for engine_root in engine_installs:
+                build_version_path = (engine_root / UE_ENGINE_FOLDER_NAME / UE_ENGINE_BUILD_FOLDER_NAME
+                                      / UE_ENGINE_BUILD_VERSION_FILE_NAME)
+                modules_path = (engine_root / UE_ENGINE_FOLDER_NAME / UE_BINARIES_FOLDER_NAME
+                                / UE_PLATFORM_WINDOWS_NAME / UE_ENGINE_EDITOR_MODULES_FILE_NAME)
+                states = self.changed_source_states((build_version_path, modules_path), metrics)
+                if states is not None:
+                    build_version = self.read_source(build_version_path, states[build_version_path], metrics)
+                    modules_data = self.read_source(modules_path, states[modules_path], metrics)
+                    if build_version is not None and modules_data is not None:
+                        build_id = modules_data.get("BuildId")
+                        self.connection.execute("INSERT OR REPLACE INTO engines VALUES (?, ?, ?, ?, ?, ?)",
+                                                (os.fspath(engine_root), build_version.get("MajorVersion"),
+                                                 build_version.get("MinorVersion"),
+                                                 build_version.get("PatchVersion"),
+                                                 build_version.get("CompatibleChangelist"),
+                                                 str(build_id) if build_id is not None else None))
+                        self.record_source_states(states)
+                        metrics.files_touched += 1
+                plugin_files = sorted((engine_root / UE_ENGINE_FOLDER_NAME / UE_PLUGINS_FOLDER_NAME).glob(
+                    f"{UE_MARKETPLACE_PLUGINS_FOLDER_NAME}/*/*.{UE_UPLUGIN_EXT}"))
+                self.refresh_plugins(engine_root, plugin_files, metrics)
+
+            for project_root in projects:
+                project_file = project_root / f"{project_root.name}.{UE_UPROJECT_EXT}"
+                states = self.changed_source_states((project_file,), metrics)
+                if states is not None:
+                    project_data = self.read_source(project_file, states[project_file], metrics)
+                    if project_data is not None:
+                        self.connection.execute("INSERT OR REPLACE INTO projects VALUES (?, ?)",
+                                                (os.fspath(project_root), project_data.get("EngineAssociation")))
+                        self.record_source_states(states)
+                        metrics.files_touched += 1
+                plugin_files = sorted((project_root / UE_PLUGINS_FOLDER_NAME).glob(f"*/*.{UE_UPLUGIN_EXT}"))
+                self.refresh_plugins(project_root, plugin_files, metrics)
+
+            # Forget installs and projects that are no longer known
+            known_roots = [os.fspath(root) for root in (*engine_installs, *projects)]
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS known_roots (root TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM known_roots")
+            self.connection.executemany("INSERT OR IGNORE INTO known_roots VALUES (?)",
+                                        ((root,) for root in known_roots))
+            for table, column in (("engines", "root"), ("projects", "root"), ("plugins", "owner_root")):
+                self.connection.execute(f"DELETE FROM {table} WHERE {column} NOT IN (SELECT root FROM known_roots)")
+            return metrics.files_touched
+
+    def engines(self) -> list[UEEngineRecord]:
+        rows = self.connection.execute("SELECT * FROM engines ORDER BY root").fetchall()
+        return [UEEngineRecord(Path(row[0]), *row[1:]) for row in rows]
+
+    def plugin_records(self, plugin_name: str, where: str = "", parameters: tuple = ()) -> list[UEPluginRecord]:
+        rows = self.connection.execute(
+            "SELECT name, owner_root, plugin_file, version, version_name, build_id FROM plugins p"
+            f" WHERE name = ? {where} ORDER BY version DESC, owner_root", (plugin_name, *parameters)).fetchall()
+        return [UEPluginRecord(name=row[0], owner_root=Path(row[1]), plugin_file=Path(row[2]), version=row[3],
+                               version_name=row[4], build_id=row[5]) for row in rows]
+
+    def plugin_installs(self, plugin_name: str) -> list[UEPluginRecord]:
+        return self.plugin_records(plugin_name, "AND owner_root IN (SELECT root FROM engines)")
+
+    def newer_plugin_installs(self, plugin_name: str, project_root: Path) -> list[UEPluginRecord]:
+        # Engine installs with a higher .uplugin Version of the plugin than the project's copy. A project
+        # without the plugin gets every install that has it.
+        return self.plugin_records(
+            plugin_name,
+            "AND owner_root IN (SELECT root FROM engines) AND version > COALESCE("
+            "(SELECT MAX(version) FROM plugins WHERE name = p.name AND owner_root = ?), -1)",
+            (os.fspath(project_root),))
+
+    def compatible_plugin_installs(self, plugin_name: str, engine_root: Path) -> list[UEPluginRecord]:
+        # Installed copies whose binaries were built against the given engine's BuildId
+        return self.plugin_records(plugin_name, "AND build_id = (SELECT build_id FROM engines WHERE root = ?)",
+                                   (os.fspath(engine_root),))
+
+
+class InotifyWatcher:
+    # Recursive inotify watch (Linux only). Costs no CPU while nothing changes.
+
+    def __init__(self, roots: Sequence[Path]):
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number))
+        self._watch_paths: dict[int, Path] = {}
+        self.overflowed = False
+        for root in roots:
+            self.add_tree(Path(root))
+
+    def add_watch(self, path: Path) -> None:
+        watch_descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(path), INOTIFY_WATCH_MASK)
+        if watch_descriptor < 0:
+            error_number = ctypes.get_errno()
+            if error_number in (errno.ENOENT, errno.ENOTDIR):
+                return  # removed before we got to it
+            raise OSError(error_number, os.strerror(error_number), os.fspath(path))
+        self._watch_paths[watch_descriptor] = path
+
+    def add_tree(self, root: Path) -> None:
+        for dir_path, _, _ in os.walk(root):
+            self.add_watch(Path(dir_path))
+
+    def wait(self, timeout: float) -> set[Path]:
+        changed_paths = set()
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return changed_paths
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed_paths
+
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                self._watch_paths.pop(watch_descriptor, None)
+                continue
+            watch_path = self._watch_paths.get(watch_descriptor)
+            if watch_path is None:
+                continue
+            path = watch_path / os.fsdecode(name) if name else watch_path
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # New folders need their own watches, and anything already copied into them counts as changed
+                self.add_tree(path)
+                changed_paths.update(Path(dir_path) / file_name
+                                     for dir_path, _, file_names in os.walk(path) for file_name in file_names)
+            changed_paths.add(path)
+        return changed_paths
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    # Fallback for platforms without inotify: re-stats every file each poll_interval
+
+    def __init__(self, roots: Sequence[Path], poll_interval: float = WATCH_POLL_INTERVAL_SECONDS):
+        self.roots = [Path(root) for root in roots]
+        self.poll_interval = poll_interval
+        self.overflowed = False
+        self._snapshot = self.take_snapshot()
+        self._next_poll = time.monotonic() + poll_interval
+
+    def take_snapshot(self) -> dict[Path, tuple[int, int]]:
+        snapshot = {}
+        for root in self.roots:
+            if not root.is_dir():
+                continue
+            for rel_path, file_stat in iter_plugin_files(root):
+                snapshot[root / rel_path] = (file_stat.st_size, file_stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout: float) -> set[Path]:
+        sleep_time = self._next_poll - time.monotonic()
+        if sleep_time > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(sleep_time, 0.0))
+        self._next_poll = time.monotonic() + self.poll_interval
+
+        snapshot = self.take_snapshot()
+        changed_paths = {path for path in snapshot.keys() | self._snapshot.keys()
+                         if snapshot.get(path) != self._snapshot.get(path)}
+        self._snapshot = snapshot
+        return changed_paths
+
+    def close(self) -> None:
+        pass
+
+
+def make_plugin_watcher(roots: Sequence[Path], use_inotify: Optional[bool] = None,
+                        poll_interval: float = WATCH_POLL_INTERVAL_SECONDS) -> InotifyWatcher | PollingWatcher:
+    if use_inotify is None:
+        use_inotify = sys.platform.startswith("linux")
+    if use_inotify:
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):  # no libc inotify symbols or out of watches
+            pass
+    return PollingWatcher(roots, poll_interval=poll_interval)
+
+
+def watch_marketplace_plugins(unreal_install_paths: Sequence[Path], dest_paths: Sequence[os.PathLike],
+                              stop_event: Optional[threading.Event] = None,
+                              debounce: float = WATCH_DEBOUNCE_SECONDS,
+                              poll_interval: float = WATCH_POLL_INTERVAL_SECONDS,
+                              use_inotify: Optional[bool] = None,
+                              copy_filter: Optional[PluginCopyFilter] = None,
+                              backend: CopyBackend = CopyBackend.COPY,
+                              on_sync: Optional[Callable[[UnrealPlugin, Path, PluginSyncSummary], None]] = None
+                              ) -> None:
+    # Watches Engine/Plugins/Marketplace of every install and pushes changed files into
+    # <dest_path>/<plugin name> for each dest_path (project or engine Plugins folders). Destinations that
+    # don't have the plugin yet get a full copy of it.
+    # Changes are collected until nothing has changed for `debounce` seconds, as the launcher writes
+    # plugins in bursts. Runs until stop_event is set.
+    stop_event = stop_event if stop_event is not None else threading.Event()
+    marketplace_paths = [Path(unreal_install_path) / UE_ENGINE_FOLDER_NAME / UE_PLUGINS_FOLDER_NAME
+                         / UE_MARKETPLACE_PLUGINS_FOLDER_NAME for unreal_install_path in unreal_install_paths]
+    watcher = make_plugin_watcher(marketplace_paths, use_inotify=use_inotify, poll_interval=poll_interval)
+
+    def sync_changes(changed_paths: set[Path], full_sync: bool) -> None:
+        changed_plugins: dict[Path, set[str]] = {}
+        for marketplace_path in marketplace_paths:
+            if full_sync:
+                for plugin_file in marketplace_path.glob(f"*/*.{UE_UPLUGIN_EXT}"):
+                    changed_plugins[plugin_file.parent] = set()
+                continue
+            for changed_path in changed_paths:
+                try:
+                    rel_parts = changed_path.relative_to(marketplace_path).parts
+                except ValueError:
+                    continue
+                if len(rel_parts) >= 2:
+                    changed_plugins.setdefault(marketplace_path / rel_parts[0], set()).add("/".join(rel_parts[1:]))
+
+        for plugin_root, rel_paths in changed_plugins.items():
+            plugin_files = list(plugin_root.glob(f"*.{UE_UPLUGIN_EXT}"))
+            if not plugin_files:
+                continue  # plugin removed (or not written yet), never delete it from destinations
+            unreal_plugin = UnrealPlugin(plugin_file=plugin_files[0], copy_filter=copy_filter)
+            for dest_path in dest_paths:
+                dest_root = Path(dest_path) / unreal_plugin.name
+                # A destination without the plugin gets all of it, never a plugin folder without its .uplugin
+                if full_sync or not (dest_root / unreal_plugin.plugin_file.name).is_file():
+                    summary = sync_ue_plugin(unreal_plugin_path=plugin_root, dest_path=dest_root,
+                                             copy_filter=unreal_plugin.copy_filter, backend=backend)
+                else:
+                    summary = sync_ue_plugin_files(unreal_plugin_path=plugin_root, dest_path=dest_root,
+                                                   rel_paths=sorted(rel_paths),
+                                                   copy_filter=unreal_plugin.copy_filter,
+                                                   backend=backend)
+                if on_sync is not None:
+                    on_sync(unreal_plugin, dest_root, summary)
+
+    pending_paths: set[Path] = set()
+    last_change_time = 0.0
+    try:
+        while not stop_event.is_set():
+            timeout = debounce if pending_paths else WATCH_POLL_INTERVAL_SECONDS
+            changed_paths = watcher.wait(timeout=min(timeout, 1.0))
+            if changed_paths:
+                pending_paths.update(changed_paths)
+                last_change_time = time.monotonic()
+            overflowed = watcher.overflowed
+            if overflowed or (pending_paths and time.monotonic() - last_change_time >= debounce):
+                watcher.overflowed = False
+                sync_changes(pending_paths, full_sync=overflowed)
+                pending_paths = set()
+    finally:
+        watcher.close()
+
+
+def create_mock_source_file(path: os.PathLike, size: int) -> None:
+    line = b"// Fake source line used for benchmarking Ditto\n"
+    with open(path, "wb") as f:
+        f.write((line * (size // len(line) + 1))[:size])
+
+
+def create_mock_binary_file(path: os.PathLike, size: int, rng: random.Random) -> None:
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            chunk_size = min(remaining, COPY_CHUNK_SIZE)
+            f.write(rng.randbytes(chunk_size))
+            remaining -= chunk_size
+
+
+def add_mock_plugin_volume(plugin_root: Path, module_names: Sequence[str], scale: MockPluginScale) -> None:
+    rng = random.Random(f"{scale.seed}:{plugin_root.name}")
+    source_folder = plugin_root / UE_SOURCE_FOLDER_NAME
+    for module_name in module_names:
+        private_folder = source_folder / module_name / UE_PRIVATE_FOLDER_NAME
+        public_folder = source_folder / module_name / UE_PUBLIC_FOLDER_NAME
+        for index in range(scale.files_per_module):
+            suffix = "" if index == 0 else str(index)
+            create_mock_source_file(path=private_folder / f"{module_name}Module{suffix}.{UE_CPP_SOURCE_EXT}",
+                                    size=rng.randint(*scale.source_file_size_range))
+            create_mock_source_file(path=public_folder / f"{module_name}Module{suffix}.{UE_CPP_HEADER_EXT}",
+                                    size=rng.randint(*scale.source_file_size_range))
+        if scale.binaries_size:
+            binaries_folder = plugin_root / UE_BINARIES_FOLDER_NAME / UE_PLATFORM_WINDOWS_NAME
+            create_mock_binary_file(path=binaries_folder / f"UnrealEditor-{module_name}.dll",
+                                    size=scale.binaries_size, rng=rng)
+
+    if scale.content_files:
+        content_folder = plugin_root / UE_CONTENT_FOLDER_NAME
+        content_folder.mkdir(exist_ok=True)
+        for index in range(scale.content_files):
+            create_mock_binary_file(path=content_folder / f"Asset{index}.uasset",
+                                    size=rng.randint(*scale.content_file_size_range), rng=rng)
+
+
+def make_mock_unreal_plugin(path: Path, plugin_name: str, scale: Optional[MockPluginScale] = None) -> None:
     mock_plugin_name = f"{plugin_name}Plugin"
     mock_plugin_editor_module_name = f"{mock_plugin_name}Editor"
     mock_uplugin_data = {
@@ -217,9 +2739,13 @@ def make_mock_unreal_plugin(path: Path, plugin_name: str) -> None:
     create_empty_file(path=mock_editor_module_public_folder / mock_editor_module_header_file_name)
     create_unreal_build_csharp_file(path=mock_editor_module_build_cs_path, module_name=mock_plugin_editor_module_name)
     create_unreal_data_file(path=mock_uplugin_file_path, data=mock_uplugin_data, indent="\t")
+    if scale is not None:
+        add_mock_plugin_volume(plugin_root=mock_plugin_root,
+                               module_names=(mock_plugin_name, mock_plugin_editor_module_name), scale=scale)
 
 
-def make_mock_unreal_install(path: Path, name: str) -> None:
+def make_mock_unreal_install(path: Path, name: str, plugin_count: int = len(MOCK_MARKETPLACE_PLUGIN_NAMES),
+                             scale: Optional[MockPluginScale] = None) -> None:
     mock_build_version_data = {
         "MajorVersion": 5,
         "MinorVersion": 3,
@@ -263,9 +2789,14 @@ def make_mock_unreal_install(path: Path, name: str) -> None:
                             extra_lines="\n\n")
     Path.mkdir(mock_unreal_marketplace_plugins_folder, parents=True)
     create_unreal_data_file(path=mock_unreal_editor_modules_path, data=mock_unreal_editor_modules_data, indent=4)
-    make_mock_unreal_plugin(path=mock_unreal_marketplace_plugins_folder, plugin_name="FakeMarketplaceZero")
-    make_mock_unreal_plugin(path=mock_unreal_marketplace_plugins_folder, plugin_name="FakeMarketplaceOne")
-    make_mock_unreal_plugin(path=mock_unreal_marketplace_plugins_folder, plugin_name="FakeMarketplaceTwo")
+    for plugin_index in range(plugin_count):
+        if plugin_index < len(MOCK_MARKETPLACE_PLUGIN_NAMES):
+            plugin_name = MOCK_MARKETPLACE_PLUGIN_NAMES[plugin_index]
+        else:
+            plugin_name = f"FakeMarketplace{plugin_index}"
+        make_mock_unreal_plugin(path=mock_unreal_marketplace_plugins_folder, plugin_name=plugin_name, scale=scale)
+    for plugin_name in MOCK_ENGINE_PLUGIN_NAMES:
+        make_mock_unreal_plugin(path=mock_unreal_engine_folder / UE_PLUGINS_FOLDER_NAME, plugin_name=plugin_name)
 
 
 def make_mock_unreal_project(path: Path, name: str) -> None:
@@ -297,6 +2828,10 @@ def make_mock_unreal_project(path: Path, name: str) -> None:
             {
                 "Name": "ScriptPlugin",
                 "Enabled": True
+            },
+            {
+                "Name": "FakeMarketplaceOnePlugin",
+                "Enabled": True
             }
         ],
         "TargetPlatforms": [
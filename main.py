@@ -1,5 +1,4 @@
 from pathlib import Path
-import json
 import pprint
 
 import ditto
@@ -28,6 +27,7 @@ if __name__ == '__main__':
     ]
 
     plugins_to_copy: list = []
+    engine_install_paths: list = []
 
     for test_project_folder in test_unreal_engine_folders:
         test_install_path = Path.cwd() / test_project_folder
@@ -39,6 +39,8 @@ if __name__ == '__main__':
               f"\tNumber of Marketplace Plugins: {len(test_marketplace_plugins)}\n"
               f"\tPlugin Names: {tuple(plugin.name for plugin in test_marketplace_plugins)}")
 
+        if ditto.is_ue_engine_install(test_install_path):
+            engine_install_paths.append(test_install_path)
         if not test_marketplace_plugins:
             continue
         # append simply adds the tuple of plugin paths...so extend() is used here
@@ -48,11 +50,9 @@ if __name__ == '__main__':
     test_copy_plugins_binaries = [True, False, False]  # These values would come from some UI or other input...
     plugin_to_copy: ditto.UnrealPlugin
     for copy_val, plugin_to_copy in enumerate(plugins_to_copy):
-        with plugin_to_copy.plugin_file.open("r") as p_file:
-            plugin_data: dict = json.load(p_file)
-            plugin_to_copy.copy_binaries = test_copy_plugins_binaries[copy_val]
-            plugin_to_copy.version = str(plugin_data["Version"])
-            plugin_to_copy.version_name = str(plugin_data["VersionName"])
+        # version/version_name are read from the .uplugin on first access
+        plugin_to_copy.copy_binaries = test_copy_plugins_binaries[copy_val]
+        print(f"{plugin_to_copy.name}: {plugin_to_copy.version} ({plugin_to_copy.version_name})")
         unreal_plugins_to_copy.append(plugin_to_copy)
 
     print(f"{pprint.pformat(unreal_plugins_to_copy)}\n{'_' * 10}")
@@ -73,18 +73,16 @@ if __name__ == '__main__':
     dest_project_plugins_path = dest_project / ditto.UE_PLUGINS_FOLDER_NAME
     print(f"Destination: {dest_project_plugins_path}")
 
-    unreal_plugin: ditto.UnrealPlugin
-    for unreal_plugin in unreal_plugins_to_copy:
-        dest_path = dest_project_plugins_path.joinpath(unreal_plugin.name)
-        Path.mkdir(dest_path)
-
-        if unreal_plugin.copy_binaries:
-            ditto.copy_ue_plugin(unreal_plugin_path=unreal_plugin.root,
-                                 dest_path=dest_path,
-                                 overwrite_files=True)
-        ditto.copy_ue_plugin_no_binaries(unreal_plugin_path=unreal_plugin.root,
-                                         dest_path=dest_path,
-                                         overwrite_files=True)
+    # Only copy what the .uproject enables, plus whatever those plugins depend on.
+    # Plugins that come with the engines themselves are already there and aren't copied.
+    plugin_resolution = ditto.resolve_project_plugins(unreal_project_path=dest_project,
+                                                      available_plugins=unreal_plugins_to_copy,
+                                                      unreal_install_paths=engine_install_paths)
+    print(f"Plugins used by the project: {tuple(plugin.name for plugin in plugin_resolution.plugins)}")
+
+    ditto.copy_ue_plugins(unreal_plugins=plugin_resolution.plugins,
+                          dest_path=dest_project_plugins_path,
+                          overwrite_files=True)
 
     # pseudocode:
     # select the plugins
@@ -1,7 +1,18 @@
-from unittest import TestCase
+from unittest import TestCase, mock
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stdout
+import errno
+import io
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import zipfile
 from typing import Sequence
-from collections import Iterable
+from collections.abc import Iterable
 
 import ditto
 
@@ -87,3 +98,902 @@ class TestIsUEEnvironment(TestCase):
         self.is_ue_env_test(test_folders=self.test_project_folders,
                             test_pass_folder=self.test_project_folders[0],
                             func=ditto.is_ue_project)
+
+
+class MockUnrealInstallTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        with redirect_stdout(io.StringIO()):
+            ditto.make_mock_unreal_install(path=self.root, name="FakeUnrealInstall")
+            ditto.make_mock_unreal_project(path=self.root, name="FakeUnrealProject")
+        self.install_path = self.root / "FakeUnrealInstall"
+        self.project_path = self.root / "FakeUnrealProject"
+        self.project_plugins_path = self.project_path / ditto.UE_PLUGINS_FOLDER_NAME
+        self.plugins = ditto.ue_marketplace_plugins(self.install_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def plugin(self, name: str) -> ditto.UnrealPlugin:
+        return next(plugin for plugin in self.plugins if plugin.name == name)
+
+
+class TestSyncUEPlugin(MockUnrealInstallTestCase):
+
+    def test_sync_copies_only_changes(self):
+        plugin = self.plugin("FakeMarketplaceOnePlugin")
+        dest_path = self.project_plugins_path / plugin.name
+
+        first_sync = ditto.sync_ue_plugin(unreal_plugin_path=plugin.root, dest_path=dest_path)
+        self.assertEqual(len(first_sync.copied), 8)
+        self.assertFalse(first_sync.updated or first_sync.deleted)
+
+        second_sync = ditto.sync_ue_plugin(unreal_plugin_path=plugin.root, dest_path=dest_path, compare_hash=True)
+        self.assertFalse(second_sync.changed)
+
+        changed_file = "Source/FakeMarketplaceOnePlugin/Private/FakeMarketplaceOnePluginModule.cpp"
+        (plugin.root / changed_file).write_text("// changed")
+        removed_folder = plugin.root / ditto.UE_SOURCE_FOLDER_NAME / "FakeMarketplaceOnePluginEditor"
+        shutil.rmtree(removed_folder)
+
+        third_sync = ditto.sync_ue_plugin(unreal_plugin_path=plugin.root, dest_path=dest_path)
+        self.assertEqual(third_sync.updated, [changed_file])
+        self.assertEqual(len(third_sync.deleted), 3)
+        self.assertFalse((dest_path / ditto.UE_SOURCE_FOLDER_NAME / "FakeMarketplaceOnePluginEditor").exists())
+
+    def test_sync_no_binaries(self):
+        plugin = self.plugin("FakeMarketplaceTwoPlugin")
+        dest_path = self.project_plugins_path / plugin.name
+
+        summary = ditto.sync_ue_plugin(unreal_plugin_path=plugin.root, dest_path=dest_path,
+                                       copy_filter=ditto.PLUGIN_COPY_FILTER_NO_BINARIES)
+        self.assertTrue(summary.copied)
+        self.assertFalse((dest_path / ditto.UE_BINARIES_FOLDER_NAME).exists())
+
+
+class TestCopyUEPlugins(MockUnrealInstallTestCase):
+
+    def test_copy_ue_plugins_batch(self):
+        self.plugins[0].copy_binaries = False
+        dest_roots = ditto.copy_ue_plugins(unreal_plugins=self.plugins, dest_path=self.project_plugins_path,
+                                           overwrite_files=False, max_workers=4)
+
+        self.assertEqual(dest_roots, [self.project_plugins_path / plugin.name for plugin in self.plugins])
+        for plugin, dest_root in zip(self.plugins, dest_roots):
+            self.assertTrue((dest_root / plugin.plugin_file.name).is_file())
+            self.assertEqual((dest_root / ditto.UE_BINARIES_FOLDER_NAME).exists(), plugin.copy_binaries)
+
+        with self.assertRaises(FileExistsError):
+            ditto.copy_ue_plugins(unreal_plugins=self.plugins, dest_path=self.project_plugins_path,
+                                  overwrite_files=False)
+
+
+class TestPluginManifest(MockUnrealInstallTestCase):
+
+    def test_check_marketplace_plugin_updates(self):
+        first_check = ditto.check_marketplace_plugin_updates(self.install_path)
+        self.assertEqual(len(first_check), 3)
+        for plugin in self.plugins:
+            self.assertTrue(ditto.plugin_manifest_path(plugin).is_file())
+        self.assertEqual(ditto.check_marketplace_plugin_updates(self.install_path), [])
+
+        plugin = self.plugin("FakeMarketplaceZeroPlugin")
+        changed_file = "Source/FakeMarketplaceZeroPlugin/Public/FakeMarketplaceZeroPluginModule.h"
+        (plugin.root / changed_file).write_text("#pragma once\n")
+        (plugin.root / ditto.UE_CONTENT_FOLDER_NAME).mkdir()
+        (plugin.root / ditto.UE_CONTENT_FOLDER_NAME / "Asset.uasset").write_bytes(b"\0" * 16)
+        os.utime(plugin.root / plugin.plugin_file.name)  # touched but unchanged
+
+        changes, = ditto.check_marketplace_plugin_updates(self.install_path)
+        self.assertEqual(changes.name, plugin.name)
+        self.assertEqual(changes.modified, [changed_file])
+        self.assertEqual(changes.added, ["Content/Asset.uasset"])
+        self.assertEqual(changes.removed, [])
+
+
+class TestCopyBackends(MockUnrealInstallTestCase):
+
+    def test_copy_ue_plugin_backends(self):
+        plugin = self.plugin("FakeMarketplaceZeroPlugin")
+        for backend in ditto.CopyBackend:
+            with self.subTest(backend=backend):
+                dest_path = self.project_plugins_path / backend.value
+                ditto.copy_ue_plugin(unreal_plugin_path=plugin.root, dest_path=dest_path,
+                                     overwrite_files=False, backend=backend)
+                # Copying again over an existing tree must work for every backend
+                ditto.copy_ue_plugin_no_binaries(unreal_plugin_path=plugin.root, dest_path=dest_path,
+                                                 overwrite_files=True, backend=backend)
+                src_files = dict(ditto.iter_plugin_files(plugin.root))
+                dest_files = dict(ditto.iter_plugin_files(dest_path))
+                self.assertEqual(src_files.keys(), dest_files.keys())
+                for rel_path in src_files:
+                    self.assertEqual((plugin.root / rel_path).read_bytes(), (dest_path / rel_path).read_bytes())
+
+    def test_only_capability_errors_fall_back(self):
+        plugin = self.plugin("FakeMarketplaceZeroPlugin")
+        dest_file = self.root / plugin.plugin_file.name
+
+        def failing(error_number):
+            return mock.Mock(side_effect=OSError(error_number, os.strerror(error_number)))
+
+        for error_number in (errno.EXDEV, errno.EPERM):
+            with self.subTest(error_number=error_number), mock.patch.object(ditto.os, "link", failing(error_number)):
+                ditto.copy_file_hardlink(plugin.plugin_file, dest_file)
+                self.assertEqual(dest_file.read_bytes(), plugin.plugin_file.read_bytes())
+        for error_number in (errno.EACCES, errno.ETXTBSY, errno.EBADF):
+            with self.subTest(error_number=error_number), mock.patch.object(ditto.os, "link", failing(error_number)):
+                with self.assertRaises(OSError):
+                    ditto.copy_file_hardlink(plugin.plugin_file, dest_file)
+        if ditto.fcntl is not None:
+            with mock.patch.object(ditto.fcntl, "ioctl", failing(errno.EPERM)), self.assertRaises(PermissionError):
+                ditto.copy_file_reflink(plugin.plugin_file, dest_file)
+            with mock.patch.object(ditto.fcntl, "ioctl", failing(errno.EOPNOTSUPP)):
+                ditto.copy_file_reflink(plugin.plugin_file, dest_file)
+                self.assertEqual(dest_file.read_bytes(), plugin.plugin_file.read_bytes())
+
+    def test_hardlink_backend_links_files(self):
+        plugin = self.plugin("FakeMarketplaceOnePlugin")
+        dest_path = self.project_plugins_path / plugin.name
+        ditto.copy_ue_plugin(unreal_plugin_path=plugin.root, dest_path=dest_path,
+                             overwrite_files=False, backend=ditto.CopyBackend.HARDLINK)
+        self.assertTrue(os.path.samefile(plugin.plugin_file, dest_path / plugin.plugin_file.name))
+
+
+class TestDiscoverUEEnvironments(MockUnrealInstallTestCase):
+
+    def test_locate_ue_environments(self):
+        pruned_project_path = self.root / "Saved"
+        with redirect_stdout(io.StringIO()):
+            ditto.make_mock_unreal_project(path=pruned_project_path, name="HiddenProject")
+        registry_path = self.root / "registry.json"
+
+        registry = ditto.locate_ue_environments(roots=[self.root], registry_path=registry_path)
+        self.assertEqual(registry.engine_installs, [self.install_path])
+        self.assertEqual(registry.projects, [self.project_path])
+        self.assertEqual(ditto.load_ue_registry(registry_path), registry)
+
+        shutil.rmtree(self.project_path)
+        revalidated = ditto.locate_ue_environments(roots=[self.root], registry_path=registry_path)
+        self.assertEqual(revalidated.engine_installs, [self.install_path])
+        self.assertEqual(revalidated.projects, [])
+
+    def test_discover_common_layouts(self):
+        # Folders named like the ones inside a project still get searched, e.g. D:/Source/UnrealEngine
+        with redirect_stdout(io.StringIO()):
+            ditto.make_mock_unreal_install(path=self.root / "Source", name="UnrealEngine")
+            ditto.make_mock_unreal_project(path=self.root / "Content", name="MyGame")
+        registry = ditto.discover_ue_environments(roots=[self.root])
+        self.assertEqual(registry.engine_installs, sorted([self.install_path, self.root / "Source/UnrealEngine"]))
+        self.assertEqual(registry.projects, sorted([self.project_path, self.root / "Content/MyGame"]))
+
+    def test_discover_respects_max_depth(self):
+        # Nested/Deeper/DeepInstall is two levels below the scanned root
+        nested_root = self.root / "Nested"
+        with redirect_stdout(io.StringIO()):
+            ditto.make_mock_unreal_install(path=nested_root / "Deeper", name="DeepInstall")
+            ditto.make_mock_unreal_project(path=nested_root / "Deeper", name="DeepProject")
+        registry = ditto.discover_ue_environments(roots=[nested_root], max_depth=1)
+        self.assertEqual(registry.engine_installs, [])
+        self.assertEqual(registry.projects, [])
+        registry = ditto.discover_ue_environments(roots=[nested_root], max_depth=2)
+        self.assertEqual(registry.engine_installs, [nested_root / "Deeper/DeepInstall"])
+        self.assertEqual(registry.projects, [nested_root / "Deeper/DeepProject"])
+
+
+class TestClassifyUEFolders(MockUnrealInstallTestCase):
+
+    def test_classify_ue_folders(self):
+        listing_cache = ditto.DirectoryListingCache()
+        missing_path = self.root / "UnrealInstall"
+        folder_kinds = ditto.classify_ue_folders([self.install_path, self.project_path, missing_path, self.root],
+                                                 listing_cache=listing_cache)
+        self.assertEqual(folder_kinds, {
+            self.install_path: ditto.UEFolderKind.ENGINE_INSTALL,
+            self.project_path: ditto.UEFolderKind.PROJECT,
+            missing_path: ditto.UEFolderKind.NONE,
+            self.root: ditto.UEFolderKind.NONE
+        })
+
+        # Every directory is only listed once however many checks touch it
+        listings_issued = listing_cache.listings_issued
+        ditto.classify_ue_folders([self.install_path, self.project_path], listing_cache=listing_cache)
+        self.assertEqual(listing_cache.listings_issued, listings_issued)
+
+
+class TestUnrealPlugin(MockUnrealInstallTestCase):
+
+    def test_metadata_is_lazy_and_cached(self):
+        plugin = self.plugin("FakeMarketplaceZeroPlugin")
+        self.assertIsNone(plugin._metadata)
+        self.assertFalse(hasattr(plugin, "__dict__"))
+
+        self.assertEqual(plugin.version, "1")
+        self.assertEqual(plugin.version_name, "1.0")
+        self.assertEqual([module["Name"] for module in plugin.modules],
+                         ["FakeMarketplaceZeroPlugin", "FakeMarketplaceZeroPluginEditor"])
+        self.assertEqual(plugin.plugin_dependencies, ())
+        self.assertIs(plugin.metadata, plugin.metadata)
+
+        metadata = dict(plugin.metadata, Version=2, VersionName="2.0")
+        ditto.create_unreal_data_file(path=plugin.plugin_file, data=metadata, indent="\t")
+        os.utime(plugin.plugin_file, ns=(0, plugin._metadata_mtime_ns + 1_000_000_000))
+        self.assertEqual(plugin.version, "2")
+        self.assertEqual(plugin.version_name, "2.0")
+
+
+class TestFanOutUEPlugin(MockUnrealInstallTestCase):
+
+    def test_fan_out_ue_plugin(self):
+        plugin = self.plugin("FakeMarketplaceOnePlugin")
+        dest_paths = [self.project_plugins_path, self.root / "SourceBuildA" / ditto.UE_PLUGINS_FOLDER_NAME,
+                      self.root / "SourceBuildB" / ditto.UE_PLUGINS_FOLDER_NAME]
+        (self.project_plugins_path / plugin.name).mkdir()
+
+        results = ditto.fan_out_ue_plugin(unreal_plugin=plugin, dest_paths=dest_paths, overwrite_files=False)
+
+        project_result = results[self.project_plugins_path / plugin.name]
+        self.assertFalse(project_result.ok)
+        self.assertEqual(project_result.files_written, 0)
+        src_files = dict(ditto.iter_plugin_files(plugin.root))
+        for dest_path in dest_paths[1:]:
+            result = results[dest_path / plugin.name]
+            self.assertTrue(result.ok)
+            self.assertEqual(result.files_written, len(src_files))
+            self.assertEqual(result.bytes_written, sum(file_stat.st_size for file_stat in src_files.values()))
+            for rel_path in src_files:
+                self.assertEqual((plugin.root / rel_path).read_bytes(),
+                                 (dest_path / plugin.name / rel_path).read_bytes())
+
+
+class TestPluginPipeline(MockUnrealInstallTestCase):
+
+    def test_run_plugin_pipeline(self):
+        results = list(ditto.run_plugin_pipeline(unreal_install_paths=[self.install_path, self.project_path],
+                                                 dest_path=self.project_plugins_path,
+                                                 select=lambda plugin: plugin.name != "FakeMarketplaceTwoPlugin"))
+        self.assertEqual(sorted(result.plugin.name for result in results),
+                         ["FakeMarketplaceOnePlugin", "FakeMarketplaceZeroPlugin"])
+        for result in results:
+            self.assertTrue(result.ok)
+            self.assertTrue(result.copied and result.verified)
+            self.assertEqual(result.dest_path, self.project_plugins_path / result.plugin.name)
+
+    def test_run_plugin_pipeline_stops_on_error(self):
+        results = list(ditto.run_plugin_pipeline(unreal_install_paths=[self.install_path],
+                                                 dest_path=self.project_plugins_path,
+                                                 overwrite_files=False, stop_on_error=True))
+        self.assertEqual(len(results), 3)
+
+        failed, = ditto.run_plugin_pipeline(unreal_install_paths=[self.install_path],
+                                            dest_path=self.project_plugins_path,
+                                            overwrite_files=False, stop_on_error=True)
+        self.assertIsInstance(failed.error, FileExistsError)
+        self.assertEqual(failed.failed_stage, "copy")
+
+    def test_discovery_errors_end_the_pipeline(self):
+        results = list(ditto.run_plugin_pipeline(unreal_install_paths=[os.fspath(self.install_path)],
+                                                 dest_path=self.project_plugins_path))
+        self.assertEqual([(type(result.error), result.failed_stage) for result in results],
+                         [(TypeError, "discover")])
+
+        with mock.patch.object(ditto, "iter_ue_marketplace_plugins", side_effect=RuntimeError("discovery failed")):
+            results = list(ditto.run_plugin_pipeline(unreal_install_paths=[self.install_path],
+                                                     dest_path=self.project_plugins_path))
+        self.assertEqual([(type(result.error), result.failed_stage) for result in results],
+                         [(RuntimeError, "discover")])
+
+
+class TestMockUnrealInstallScale(TestCase):
+
+    def test_make_mock_unreal_install_scale(self):
+        scale = ditto.MockPluginScale(files_per_module=3, source_file_size_range=(10, 20), binaries_size=64,
+                                      content_files=2, content_file_size_range=(100, 100))
+        with TemporaryDirectory() as temp_dir, redirect_stdout(io.StringIO()):
+            ditto.make_mock_unreal_install(path=Path(temp_dir), name="ScaledInstall", plugin_count=5, scale=scale)
+            unreal_plugins = ditto.ue_marketplace_plugins(Path(temp_dir) / "ScaledInstall")
+
+            self.assertEqual(len(unreal_plugins), 5)
+            for unreal_plugin in unreal_plugins:
+                plugin_files = dict(ditto.iter_plugin_files(unreal_plugin.root))
+                # .uplugin + .modules + 2 modules * (Build.cs + 3 * (cpp + h) + dll) + content
+                self.assertEqual(len(plugin_files), 2 + 2 * (1 + 3 * 2 + 1) + 2)
+                self.assertEqual(plugin_files["Content/Asset0.uasset"].st_size, 100)
+
+
+class TestInstrumentation(MockUnrealInstallTestCase):
+
+    def test_ditto_report(self):
+        plugin = self.plugin("FakeMarketplaceOnePlugin")
+        report_path = self.root / "report.json"
+        with ditto.ditto_report() as report:
+            ditto.ue_marketplace_plugins(self.install_path)
+            plugin.version
+            ditto.copy_ue_plugin(unreal_plugin_path=plugin.root, dest_path=self.project_plugins_path / plugin.name,
+                                 overwrite_files=False)
+            with self.assertRaises(FileExistsError):
+                ditto.copy_ue_plugin(unreal_plugin_path=plugin.root,
+                                     dest_path=self.project_plugins_path / plugin.name, overwrite_files=False)
+            report.dump_json(report_path)
+        self.assertNotIn(report, ditto.DITTO_HOOKS)
+
+        totals = json.loads(report_path.read_text())["Totals"]
+        self.assertEqual(totals["ue_marketplace_plugins"]["FilesTouched"], 3)
+        self.assertEqual(totals["load_metadata"]["Count"], 1)
+        self.assertEqual(totals["copy_ue_plugin"]["Count"], 2)
+        self.assertEqual(totals["copy_ue_plugin"]["Errors"], 1)
+        self.assertEqual(totals["copy_ue_plugin"]["FilesTouched"], 8)
+        self.assertEqual(totals["copy_ue_plugin"]["BytesCopied"],
+                         sum(file_stat.st_size for _, file_stat in ditto.iter_plugin_files(plugin.root)))
+
+    def test_failing_hook(self):
+        def failing_hook(metrics):
+            raise RuntimeError("hook broke")
+
+        ditto.register_ditto_hook(failing_hook)
+        try:
+            with ditto.ditto_report() as report:
+                self.assertTrue(ditto.is_ue_engine_install(self.install_path))
+                self.assertFalse(ditto.is_ue_engine_install(self.root / "Missing"))
+                # The body's own error still comes through
+                with self.assertRaises(FileNotFoundError):
+                    ditto.copy_ue_plugin(unreal_plugin_path=self.root / "Missing", dest_path=self.root / "Dest",
+                                         overwrite_files=False)
+        finally:
+            ditto.unregister_ditto_hook(failing_hook)
+        # Hooks registered after the failing one still see every phase
+        self.assertEqual([metrics.stats_issued for metrics in report.phases
+                          if metrics.phase == "is_ue_engine_install"], [2, 1])
+
+
+class TestDiffUEPlugin(MockUnrealInstallTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.unreal_plugin = self.plugin("FakeMarketplaceTwoPlugin")
+        self.project_plugin_path = self.project_plugins_path / self.unreal_plugin.name
+        ditto.copy_ue_plugin(unreal_plugin_path=self.unreal_plugin.root, dest_path=self.project_plugin_path,
+                             overwrite_files=False)
+        self.runtime_source = "Source/FakeMarketplaceTwoPlugin/Private/FakeMarketplaceTwoPluginModule.cpp"
+        self.editor_source = "Source/FakeMarketplaceTwoPluginEditor/Private/FakeMarketplaceTwoPluginEditorModule.cpp"
+        self.runtime_header = "Source/FakeMarketplaceTwoPlugin/Public/FakeMarketplaceTwoPluginModule.h"
+
+    def test_diff_with_baseline(self):
+        ditto.record_plugin_baseline(self.unreal_plugin, self.project_plugin_path)
+        self.assertFalse(ditto.diff_ue_plugin(self.unreal_plugin, self.project_plugin_path).has_local_changes)
+
+        (self.unreal_plugin.root / self.runtime_source).write_text("// upstream")
+        (self.project_plugin_path / self.editor_source).write_text("// local")
+        (self.unreal_plugin.root / self.runtime_header).write_text("// upstream")
+        (self.project_plugin_path / self.runtime_header).write_text("// local")
+
+        plugin_diff = ditto.diff_ue_plugin(self.unreal_plugin, self.project_plugin_path)
+        self.assertEqual(plugin_diff.upstream_changed, [self.runtime_source])
+        self.assertEqual(plugin_diff.locally_modified, [self.editor_source])
+        self.assertEqual(plugin_diff.both_changed, [self.runtime_header])
+        self.assertEqual(len(plugin_diff.unchanged), 5)
+
+        merge_stage_path = self.root / "Merge"
+        ditto.apply_upstream_changes(self.unreal_plugin, self.project_plugin_path, plugin_diff,
+                                     merge_stage_path=merge_stage_path)
+        self.assertEqual((self.project_plugin_path / self.runtime_source).read_text(), "// upstream")
+        self.assertEqual((self.project_plugin_path / self.editor_source).read_text(), "// local")
+        self.assertEqual((self.project_plugin_path / self.runtime_header).read_text(), "// local")
+        self.assertEqual((merge_stage_path / self.runtime_header).read_text(), "// upstream")
+
+    def test_diff_without_baseline(self):
+        local_file = self.project_plugin_path / self.editor_source
+        local_file.write_text("// local")
+        src_mtime_ns = (self.unreal_plugin.root / self.editor_source).stat().st_mtime_ns
+        os.utime(local_file, ns=(src_mtime_ns, src_mtime_ns + 5_000_000_000))
+
+        plugin_diff = ditto.diff_ue_plugin(self.unreal_plugin, self.project_plugin_path)
+        self.assertEqual(plugin_diff.locally_modified, [self.editor_source])
+        self.assertEqual(plugin_diff.upstream_changed, [])
+
+
+class TestPluginStore(MockUnrealInstallTestCase):
+
+    def test_ingest_materialize_collect_verify(self):
+        store = ditto.PluginStore(self.root / "Store")
+        trees = store.ingest_install(self.install_path)
+        self.assertEqual(len(store.trees()), 3)
+        # The three mock plugins only differ in names, so only unique contents are stored
+        unique_hashes = {entry.hash for tree in trees for entry in tree.files.values()}
+        self.assertEqual(len(list(store.iter_objects())), len(unique_hashes))
+
+        plugin = self.plugin("FakeMarketplaceOnePlugin")
+        dest_path = self.project_plugins_path / plugin.name
+        no_binaries = ditto.PLUGIN_COPY_FILTER_NO_BINARIES
+        tree_id = store.tree_id(next(tree for tree in trees if tree.name == plugin.name))
+        store.materialize(plugin.name, plugin.version, tree_id, dest_path, copy_filter=no_binaries,
+                          backend=ditto.CopyBackend.HARDLINK)
+        self.assertEqual(dict(ditto.iter_plugin_files(plugin.root, copy_filter=no_binaries)).keys(),
+                         dict(ditto.iter_plugin_files(dest_path)).keys())
+        self.assertTrue(store.verify().ok)
+
+        # Writing through a hardlink corrupts the shared object
+        with (dest_path / plugin.plugin_file.name).open("a") as f:
+            f.write("\n")
+        self.assertEqual(len(store.verify().corrupt), 1)
+
+        for name, version, tree_id in store.trees():
+            store.remove_tree(name, version, tree_id)
+        collection = store.collect_garbage()
+        self.assertEqual(collection.removed_objects, len(unique_hashes))
+        self.assertEqual(list(store.iter_objects()), [])
+
+    def test_same_version_from_several_installs(self):
+        with redirect_stdout(io.StringIO()):
+            ditto.make_mock_unreal_install(path=self.root, name="OtherUnrealInstall")
+        other_plugin = next(plugin for plugin in ditto.ue_marketplace_plugins(self.root / "OtherUnrealInstall")
+                            if plugin.name == "FakeMarketplaceOnePlugin")
+        # The other engine's build has another BuildId but the same size and mtime, only hashing tells them apart
+        binary_file = "Binaries/Win64/UnrealEditor.modules"
+        plugin = self.plugin("FakeMarketplaceOnePlugin")
+        src_stat = (plugin.root / binary_file).stat()
+        other_binary = other_plugin.root / binary_file
+        other_binary.write_text(other_binary.read_text().replace("27405482", "27405483"))
+        os.utime(other_binary, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+        store = ditto.PluginStore(self.root / "Store")
+        tree = store.ingest(plugin)
+        other_tree = store.ingest(other_plugin)
+        self.assertNotEqual(store.tree_id(tree), store.tree_id(other_tree))
+        self.assertEqual(len(store.trees()), 2)
+        self.assertEqual(store.collect_garbage().removed_objects, 0)
+
+        for unreal_plugin, plugin_tree in ((plugin, tree), (other_plugin, other_tree)):
+            dest_path = self.root / "Materialized" / store.tree_id(plugin_tree)
+            store.materialize(unreal_plugin.name, unreal_plugin.version, store.tree_id(plugin_tree), dest_path)
+            self.assertEqual((dest_path / binary_file).read_bytes(), (unreal_plugin.root / binary_file).read_bytes())
+
+
+class TestWatchMarketplacePlugins(MockUnrealInstallTestCase):
+
+    def watch_test(self, use_inotify: bool) -> None:
+        plugin = self.plugin("FakeMarketplaceZeroPlugin")
+        changed_file = "Source/FakeMarketplaceZeroPlugin/Private/FakeMarketplaceZeroPluginModule.cpp"
+        synced = {}
+        sync_event = threading.Event()
+        stop_event = threading.Event()
+        ditto.copy_ue_plugin(unreal_plugin_path=plugin.root, dest_path=self.project_plugins_path / plugin.name,
+                             overwrite_files=True)
+        new_project_plugins_path = self.root / "NewProject" / ditto.UE_PLUGINS_FOLDER_NAME
+
+        def on_sync(unreal_plugin, dest_root, summary):
+            synced[dest_root] = (unreal_plugin.name, summary)
+            if len(synced) == 2:
+                sync_event.set()
+
+        watch_thread = threading.Thread(target=ditto.watch_marketplace_plugins,
+                                        kwargs=dict(unreal_install_paths=[self.install_path],
+                                                    dest_paths=[self.project_plugins_path,
+                                                                new_project_plugins_path],
+                                                    stop_event=stop_event, debounce=0.1, poll_interval=0.1,
+                                                    use_inotify=use_inotify, on_sync=on_sync))
+        watch_thread.start()
+        try:
+            time.sleep(0.3)
+            (plugin.root / changed_file).write_text("// updated by the launcher")
+            self.assertTrue(sync_event.wait(timeout=10))
+        finally:
+            stop_event.set()
+            watch_thread.join()
+
+        # Only the changed file is pushed to a destination that already has the plugin
+        name, summary = synced[self.project_plugins_path / plugin.name]
+        self.assertEqual(name, plugin.name)
+        self.assertEqual(summary.updated, [changed_file])
+        self.assertFalse(summary.copied)
+        # The other destination didn't have it, so it gets the whole plugin instead of a lone .cpp
+        new_dest_root = new_project_plugins_path / plugin.name
+        name, summary = synced[new_dest_root]
+        self.assertEqual(len(summary.copied), len(list(ditto.iter_plugin_files(plugin.root))))
+        for dest_root in (self.project_plugins_path / plugin.name, new_dest_root):
+            self.assertEqual((dest_root / changed_file).read_text(), "// updated by the launcher")
+            self.assertTrue((dest_root / plugin.plugin_file.name).is_file())
+
+    def test_watch_polling(self):
+        self.watch_test(use_inotify=False)
+
+    def test_watch_inotify(self):
+        if not sys.platform.startswith("linux"):
+            self.skipTest("inotify is Linux only")
+        self.watch_test(use_inotify=True)
+
+
+class TestPluginCopyFilter(MockUnrealInstallTestCase):
+
+    def test_filter_patterns(self):
+        copy_filter = ditto.PluginCopyFilter(exclude=("Binaries/*", "Intermediate", "*.pdb"),
+                                             include=("Binaries/Win64",))
+        self.assertTrue(copy_filter.accepts("Binaries/Win64/UnrealEditor-Plugin.dll"))
+        self.assertFalse(copy_filter.accepts("Binaries/Win64/UnrealEditor-Plugin.pdb"))
+        self.assertFalse(copy_filter.accepts("Binaries/Linux/libUnrealEditor-Plugin.so"))
+        self.assertFalse(copy_filter.accepts("Intermediate/Build/Win64/Plugin.obj"))
+        self.assertTrue(copy_filter.accepts("Source/Plugin/Private/PluginModule.cpp"))
+        self.assertTrue(copy_filter.descends("Binaries"))
+        self.assertFalse(copy_filter.descends("Binaries/Linux"))
+        self.assertFalse(copy_filter.descends("Source/Plugin/Intermediate"))
+
+    def test_filter_shared_by_copy_paths(self):
+        plugin = self.plugin("FakeMarketplaceZeroPlugin")
+        (plugin.root / "Binaries" / "Win64" / "UnrealEditor-FakeMarketplaceZeroPlugin.pdb").write_bytes(b"pdb")
+        (plugin.root / "Binaries" / "Linux").mkdir()
+        (plugin.root / "Binaries" / "Linux" / "libUnrealEditor-FakeMarketplaceZeroPlugin.so").write_bytes(b"so")
+        (plugin.root / "Intermediate").mkdir()
+        (plugin.root / "Intermediate" / "Build.obj").write_bytes(b"obj")
+        plugin.copy_filter = ditto.PluginCopyFilter(exclude=("Binaries/*", "Intermediate", "*.pdb"),
+                                                    include=("Binaries/Win64",))
+        self.assertTrue(plugin.copy_binaries)
+
+        expected = {rel_path for rel_path, _ in ditto.iter_plugin_files(plugin.root, copy_filter=plugin.copy_filter)}
+        self.assertIn("Binaries/Win64/UnrealEditor.modules", expected)
+        self.assertFalse(any(rel_path.startswith(("Intermediate", "Binaries/Linux")) or rel_path.endswith(".pdb")
+                             for rel_path in expected))
+
+        copytree_path = self.root / "CopyTree"
+        ditto.copy_ue_plugin(unreal_plugin_path=plugin.root, dest_path=copytree_path, overwrite_files=False,
+                             copy_filter=plugin.copy_filter)
+        sync_path = self.root / "Sync"
+        ditto.sync_ue_plugin(unreal_plugin_path=plugin.root, dest_path=sync_path, copy_filter=plugin.copy_filter)
+        dest_root, = ditto.copy_ue_plugins(unreal_plugins=[plugin], dest_path=self.project_plugins_path,
+                                           overwrite_files=False)
+        for dest_path in (copytree_path, sync_path, dest_root):
+            self.assertEqual({rel_path for rel_path, _ in ditto.iter_plugin_files(dest_path)}, expected)
+
+        plugin.copy_binaries = False
+        self.assertFalse(plugin.copy_binaries)
+        self.assertIn("*.pdb", plugin.copy_filter.exclude)
+
+    def test_copy_binaries_switch(self):
+        binary_file = "Binaries/Win64/UnrealEditor-Plugin.dll"
+        for copy_filter in (ditto.PLUGIN_COPY_FILTER_SOURCE_ONLY, ditto.PluginCopyFilter(exclude=("Binaries/*",)),
+                            ditto.PluginCopyFilter(exclude=("*.dll",)), ditto.PLUGIN_COPY_FILTER_NO_BINARIES):
+            with self.subTest(copy_filter=copy_filter):
+                self.assertFalse(copy_filter.copies_binaries)
+                with_binaries = copy_filter.with_binaries(True)
+                self.assertTrue(with_binaries.copies_binaries)
+                self.assertTrue(with_binaries.accepts(binary_file))
+                without_binaries = with_binaries.with_binaries(False)
+                self.assertFalse(without_binaries.copies_binaries)
+                self.assertFalse(without_binaries.accepts(binary_file))
+
+        # Turning Binaries back on leaves the rest of the filter alone
+        source_only = ditto.PLUGIN_COPY_FILTER_SOURCE_ONLY.with_binaries(True)
+        self.assertFalse(source_only.accepts("Content/Asset.uasset"))
+        self.assertTrue(source_only.accepts("Source/Plugin/Private/PluginModule.cpp"))
+        no_artifacts = ditto.PLUGIN_COPY_FILTER_NO_BUILD_ARTIFACTS
+        self.assertIs(no_artifacts.with_binaries(True), no_artifacts)
+        self.assertFalse(no_artifacts.with_binaries(False).with_binaries(True).accepts("Binaries/Win64/Plugin.pdb"))
+
+
+class TestCopyUEPluginAtomic(MockUnrealInstallTestCase):
+
+    def test_interrupted_copy_resumes(self):
+        plugin = self.plugin("FakeMarketplaceOnePlugin")
+        dest_root = self.project_plugins_path / plugin.name
+        ditto.copy_ue_plugin_atomic(plugin, self.project_plugins_path)
+        old_file = dest_root / "Stale.txt"
+        old_file.write_text("removed by the swap")
+
+        (plugin.root / "Content").mkdir()
+        for index in range(4):
+            (plugin.root / "Content" / f"Asset{index}.uasset").write_bytes(b"\1" * 32)
+
+        copied = []
+
+        def failing_copy(src, dest):
+            if len(copied) == 3:
+                raise KeyboardInterrupt
+            copied.append(Path(dest).relative_to(staging_path).as_posix())
+            return shutil.copy2(src, dest)
+
+        staging_path, journal_path, _ = ditto.transaction_paths(dest_root)
+        plugin_file = dest_root / plugin.plugin_file.name
+        with mock.patch.object(ditto, "copy_function_for_backend", return_value=failing_copy), \
+                self.assertRaises(KeyboardInterrupt):
+            ditto.copy_ue_plugin_atomic(plugin, self.project_plugins_path)
+
+        # The live copy is untouched by the interrupted run and the staged files aren't a discoverable plugin
+        self.assertTrue(old_file.exists())
+        self.assertEqual(list(self.project_plugins_path.rglob(f"*.{ditto.UE_UPLUGIN_EXT}")), [plugin_file])
+        self.assertEqual(staging_path.parent,
+                         self.project_path / ditto.UE_INTERMEDIATE_FOLDER_NAME / ditto.PLUGIN_STAGING_FOLDER_NAME
+                         / ditto.UE_PLUGINS_FOLDER_NAME)
+        self.assertFalse((dest_root / "Content").exists())
+        self.assertEqual(set(ditto.read_copy_journal(journal_path)) & set(copied), set(copied))
+
+        with ditto.ditto_report() as report:
+            ditto.copy_ue_plugin_atomic(plugin, self.project_plugins_path)
+        metrics, = [metrics for metrics in report.phases if metrics.phase == "copy_ue_plugin_atomic"]
+        # Only the one remaining new asset is copied, the rest is either journaled or seeded from dest_root
+        self.assertEqual(metrics.bytes_copied, 32)
+        self.assertFalse(old_file.exists())
+        self.assertFalse(staging_path.exists() or journal_path.exists())
+        self.assertEqual(set(dict(ditto.iter_plugin_files(dest_root))),
+                         set(dict(ditto.iter_plugin_files(plugin.root))))
+
+    def test_staging_outside_engine_plugins(self):
+        dest_root = self.install_path / "Engine/Plugins/Marketplace/FakeMarketplaceOnePlugin"
+        self.assertEqual(ditto.plugin_staging_folder(dest_root),
+                         self.install_path / "Engine/Intermediate/Ditto/Plugins/Marketplace")
+
+    def test_interrupted_cleanup_keeps_new_copy(self):
+        plugin = self.plugin("FakeMarketplaceOnePlugin")
+        dest_root = self.project_plugins_path / plugin.name
+        ditto.copy_ue_plugin_atomic(plugin, self.project_plugins_path)
+        changed_file = "Source/FakeMarketplaceOnePlugin/Private/FakeMarketplaceOnePluginModule.cpp"
+        (plugin.root / changed_file).write_text("// v2 upstream")
+
+        # Interrupt removing the previous copy once the new one is live
+        with mock.patch("ditto.shutil.rmtree", side_effect=KeyboardInterrupt), self.assertRaises(KeyboardInterrupt):
+            ditto.copy_ue_plugin_atomic(plugin, self.project_plugins_path)
+        self.assertEqual((dest_root / changed_file).read_text(), "// v2 upstream")
+
+        ditto.copy_ue_plugin_atomic(plugin, self.project_plugins_path)
+        self.assertEqual((dest_root / changed_file).read_text(), "// v2 upstream")
+        staging_path, journal_path, swap_path = ditto.transaction_paths(dest_root)
+        self.assertFalse(staging_path.exists() or journal_path.exists() or swap_path.exists())
+
+
+class TestPluginPack(MockUnrealInstallTestCase):
+
+    def test_pack_and_unpack(self):
+        plugin = self.plugin("FakeMarketplaceTwoPlugin")
+        plugin.copy_binaries = False
+        pack_path = self.root / "FakeMarketplaceTwoPlugin.zip"
+        index = ditto.pack_ue_plugin(plugin, pack_path)
+        self.assertEqual(index, ditto.read_plugin_pack_index(pack_path))
+
+        dest_root = ditto.unpack_ue_plugin(pack_path, self.project_plugins_path / plugin.name, max_workers=4)
+        src_files = dict(ditto.iter_plugin_files(plugin.root, copy_filter=plugin.copy_filter))
+        dest_files = dict(ditto.iter_plugin_files(dest_root))
+        self.assertEqual(src_files.keys(), dest_files.keys())
+        for rel_path, src_stat in src_files.items():
+            self.assertTrue(ditto.is_same_file_state(src_stat, dest_files[rel_path]))
+
+    def test_delta_pack(self):
+        plugin = self.plugin("FakeMarketplaceOnePlugin")
+        base_pack_path = self.root / "Base.zip"
+        ditto.pack_ue_plugin(plugin, base_pack_path)
+        changed_file = "Source/FakeMarketplaceOnePlugin/Private/FakeMarketplaceOnePluginModule.cpp"
+        (plugin.root / changed_file).write_text("// update")
+
+        delta_pack_path = self.root / "Delta.zip"
+        index = ditto.pack_ue_plugin(plugin, delta_pack_path, base_pack=base_pack_path)
+        with zipfile.ZipFile(delta_pack_path) as pack:
+            self.assertEqual(set(pack.namelist()), {changed_file, ditto.PLUGIN_PACK_INDEX_NAME})
+        self.assertEqual(len(index.files), len(dict(ditto.iter_plugin_files(plugin.root))))
+
+        with self.assertRaises(ValueError):
+            ditto.unpack_ue_plugin(delta_pack_path, self.project_plugins_path / plugin.name)
+        dest_root = ditto.unpack_ue_plugin(delta_pack_path, self.project_plugins_path / plugin.name,
+                                           base_pack=base_pack_path)
+        self.assertEqual((dest_root / changed_file).read_text(), "// update")
+        self.assertEqual((dest_root / plugin.plugin_file.name).read_bytes(), plugin.plugin_file.read_bytes())
+
+    def test_unsafe_index_paths(self):
+        plugin = self.plugin("FakeMarketplaceZeroPlugin")
+        pack_path = self.root / "Pack.zip"
+        index = ditto.pack_ue_plugin(plugin, pack_path)
+        entry = index.files[plugin.plugin_file.name]
+        dest_path = self.project_plugins_path / plugin.name
+        for unsafe_path in ("../Escaped.uplugin", "Source/../../Escaped.uplugin", os.fspath(self.root / "Escaped"),
+                            "C:/Escaped.uplugin", "..\\Escaped.uplugin"):
+            with self.subTest(unsafe_path=unsafe_path):
+                unsafe_pack_path = self.root / "Unsafe.zip"
+                unsafe_index = ditto.PluginPackIndex(name=index.name, version=index.version,
+                                                     files={unsafe_path: entry})
+                with zipfile.ZipFile(unsafe_pack_path, "w") as pack:
+                    pack.writestr(unsafe_path, plugin.plugin_file.read_bytes())
+                    pack.writestr(ditto.PLUGIN_PACK_INDEX_NAME, json.dumps(unsafe_index.to_dict()))
+                with self.assertRaisesRegex(ValueError, "unsafe path"):
+                    ditto.unpack_ue_plugin(unsafe_pack_path, dest_path)
+                self.assertFalse(dest_path.exists())
+        self.assertEqual(list(self.root.rglob("Escaped*")), [])
+
+
+class TestBuildUEPlugins(MockUnrealInstallTestCase):
+    # Stands in for UnrealBuildTool: logs the build and writes a .modules file with the engine BuildId
+    stub_build_script = (
+        "import json, pathlib, sys\n"
+        "root, build_id, log = pathlib.Path(sys.argv[1]), sys.argv[2], pathlib.Path(sys.argv[3])\n"
+        "modules_path = root / 'Binaries' / 'Win64' / 'UnrealEditor.modules'\n"
+        "data = json.loads(modules_path.read_text())\n"
+        "data['BuildId'] = build_id\n"
+        "modules_path.write_text(json.dumps(data))\n"
+        "with log.open('a') as f:\n"
+        "    f.write(root.name + '\\n')\n"
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.build_log = self.root / "build.log"
+        self.build_command = [sys.executable, "-c", self.stub_build_script, "{plugin_root}", "{build_id}",
+                              os.fspath(self.build_log)]
+
+    def build(self, **kwargs) -> list:
+        self.build_log.unlink(missing_ok=True)
+        return ditto.build_ue_plugins(self.plugins, self.install_path, build_command=self.build_command,
+                                      max_jobs=3, **kwargs)
+
+    def built(self) -> list[str]:
+        return self.build_log.read_text().split() if self.build_log.exists() else []
+
+    def test_build_ue_plugins(self):
+        self.assertEqual(self.build(), [])
+
+        # Engine BuildId moved on, every plugin is stale
+        modules_path = (self.install_path / ditto.UE_ENGINE_FOLDER_NAME / ditto.UE_BINARIES_FOLDER_NAME
+                        / ditto.UE_PLATFORM_WINDOWS_NAME / ditto.UE_ENGINE_EDITOR_MODULES_FILE_NAME)
+        ditto.create_unreal_data_file(path=modules_path, data={"BuildId": "99999999", "Modules": {}}, indent=4)
+        results = self.build()
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(sorted(self.built()), sorted(plugin.name for plugin in self.plugins))
+        self.assertEqual(self.build(), [])
+
+        # FakeMarketplaceOne depends on FakeMarketplaceZero, so a Zero source change rebuilds both, in order
+        one = self.plugin("FakeMarketplaceOnePlugin")
+        one_data = dict(one.metadata, Plugins=[{"Name": "FakeMarketplaceZeroPlugin", "Enabled": True}])
+        ditto.create_unreal_data_file(path=one.plugin_file, data=one_data, indent="\t")
+        zero = self.plugin("FakeMarketplaceZeroPlugin")
+        (zero.root / "Source/FakeMarketplaceZeroPlugin/Private/FakeMarketplaceZeroPluginModule.cpp").write_text("//")
+        results = self.build()
+        self.assertEqual({result.name: result.reason for result in results}, {
+            "FakeMarketplaceZeroPlugin": "source changed",
+            "FakeMarketplaceOnePlugin": "dependency rebuilt: FakeMarketplaceZeroPlugin"
+        })
+        self.assertEqual(self.built(), ["FakeMarketplaceZeroPlugin", "FakeMarketplaceOnePlugin"])
+
+    def test_failed_dependency_skips_dependents(self):
+        one = self.plugin("FakeMarketplaceOnePlugin")
+        one_data = dict(one.metadata, Plugins=[{"Name": "FakeMarketplaceZeroPlugin", "Enabled": True}])
+        ditto.create_unreal_data_file(path=one.plugin_file, data=one_data, indent="\t")
+        self.build_command = [sys.executable, "-c", "import sys; sys.exit(sys.argv[1] == 'FakeMarketplaceZeroPlugin')",
+                              "{plugin_name}"]
+        results = {result.name: result for result in self.build(force=True)}
+        self.assertEqual(results["FakeMarketplaceZeroPlugin"].returncode, 1)
+        self.assertTrue(results["FakeMarketplaceOnePlugin"].skipped)
+        self.assertTrue(results["FakeMarketplaceTwoPlugin"].ok)
+
+    def test_missing_build_tool(self):
+        one = self.plugin("FakeMarketplaceOnePlugin")
+        one_data = dict(one.metadata, Plugins=[{"Name": "FakeMarketplaceZeroPlugin", "Enabled": True}])
+        ditto.create_unreal_data_file(path=one.plugin_file, data=one_data, indent="\t")
+        self.build_command = [os.fspath(self.root / "NoSuchRunUAT"), "{plugin_file}"]
+        results = {result.name: result for result in self.build(force=True)}
+        self.assertEqual(len(results), 3)
+        for name in ("FakeMarketplaceZeroPlugin", "FakeMarketplaceTwoPlugin"):
+            self.assertIsNone(results[name].returncode)
+            self.assertFalse(results[name].ok)
+            self.assertIn("NoSuchRunUAT", results[name].output)
+        self.assertTrue(results["FakeMarketplaceOnePlugin"].skipped)
+
+
+class TestUECompatibilityIndex(MockUnrealInstallTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with redirect_stdout(io.StringIO()):
+            ditto.make_mock_unreal_install(path=self.root, name="NewerUnrealInstall")
+        self.newer_install_path = self.root / "NewerUnrealInstall"
+        newer_plugin = next(plugin for plugin in ditto.ue_marketplace_plugins(self.newer_install_path)
+                            if plugin.name == "FakeMarketplaceOnePlugin")
+        ditto.create_unreal_data_file(path=newer_plugin.plugin_file, data=dict(newer_plugin.metadata, Version=2),
+                                      indent="\t")
+        ditto.copy_ue_plugin(unreal_plugin_path=self.plugin("FakeMarketplaceOnePlugin").root,
+                             dest_path=self.project_plugins_path / "FakeMarketplaceOnePlugin", overwrite_files=True)
+        self.index = ditto.UECompatibilityIndex(self.root / "index.sqlite")
+
+    def tearDown(self):
+        self.index.close()
+        super().tearDown()
+
+    def refresh(self) -> int:
+        return self.index.refresh(engine_installs=[self.install_path, self.newer_install_path],
+                                  projects=[self.project_path])
+
+    def test_refresh_only_parses_changed_files(self):
+        # 2 engines + 6 engine plugins + the project + its plugin
+        self.assertEqual(self.refresh(), 10)
+        self.assertEqual(self.refresh(), 0)
+        self.assertEqual([engine.build_id for engine in self.index.engines()], ["27405482", "27405482"])
+        self.assertEqual(self.index.engines()[0].minor_version, 3)
+
+        plugin = self.plugin("FakeMarketplaceTwoPlugin")
+        ditto.create_unreal_data_file(path=plugin.plugin_file, data=dict(plugin.metadata, Version=5), indent="\t")
+        os.utime(plugin.plugin_file, ns=(0, 0))
+        self.assertEqual(self.refresh(), 1)
+        self.assertEqual(self.index.plugin_installs("FakeMarketplaceTwoPlugin")[0].version, 5)
+
+        shutil.rmtree(plugin.root)
+        self.refresh()
+        self.assertEqual(len(self.index.plugin_installs("FakeMarketplaceTwoPlugin")), 1)
+        self.index.refresh(engine_installs=[self.install_path], projects=[])
+        self.assertEqual(len(self.index.engines()), 1)
+        self.assertEqual(self.index.plugin_installs("FakeMarketplaceTwoPlugin"), [])
+
+    def test_unparsable_plugin_is_retried(self):
+        self.refresh()
+        plugin = self.plugin("FakeMarketplaceTwoPlugin")
+        plugin_data = plugin.plugin_file.read_bytes()
+        # Half written by the launcher: same size, new mtime, not valid JSON
+        plugin.plugin_file.write_bytes(b"{" + b" " * (len(plugin_data) - 1))
+        half_written_stat = plugin.plugin_file.stat()
+        self.assertEqual(self.refresh(), 0)
+        self.assertEqual(len(self.index.plugin_installs("FakeMarketplaceTwoPlugin")), 1)
+
+        # Finished without changing mtime or size, it must still be parsed again
+        plugin.plugin_file.write_bytes(plugin_data)
+        os.utime(plugin.plugin_file, ns=(half_written_stat.st_atime_ns, half_written_stat.st_mtime_ns))
+        self.assertEqual(self.refresh(), 1)
+        self.assertEqual(len(self.index.plugin_installs("FakeMarketplaceTwoPlugin")), 2)
+        self.assertEqual(self.refresh(), 0)
+
+    def test_queries(self):
+        self.refresh()
+        newer = self.index.newer_plugin_installs("FakeMarketplaceOnePlugin", self.project_path)
+        self.assertEqual([(record.owner_root, record.version) for record in newer], [(self.newer_install_path, 2)])
+        self.assertEqual(len(self.index.newer_plugin_installs("FakeMarketplaceZeroPlugin", self.project_path)), 2)
+        compatible = self.index.compatible_plugin_installs("FakeMarketplaceOnePlugin", self.install_path)
+        self.assertEqual(len(compatible), 3)
+
+        # Reopening the index keeps everything without parsing again
+        self.index.close()
+        self.index = ditto.UECompatibilityIndex(self.root / "index.sqlite")
+        self.assertEqual(self.refresh(), 0)
+
+
+class TestResolveProjectPlugins(MockUnrealInstallTestCase):
+
+    def set_dependencies(self, plugin: ditto.UnrealPlugin, *names: str, optional: bool = False) -> None:
+        dependencies = [{"Name": name, "Enabled": True, "Optional": optional} for name in names]
+        ditto.create_unreal_data_file(path=plugin.plugin_file, data=dict(plugin.metadata, Plugins=dependencies),
+                                      indent="\t")
+
+    def resolve(self, **kwargs) -> ditto.PluginResolution:
+        kwargs.setdefault("unreal_install_paths", [self.install_path])
+        return ditto.resolve_project_plugins(unreal_project_path=self.project_path, available_plugins=self.plugins,
+                                             **kwargs)
+
+    def test_resolves_dependencies_first(self):
+        self.set_dependencies(self.plugin("FakeMarketplaceOnePlugin"), "FakeMarketplaceZeroPlugin")
+        self.set_dependencies(self.plugin("FakeMarketplaceZeroPlugin"), "OptionalExtra", optional=True)
+        # BlankPlugin and ScriptPlugin ship with the engine, so they are satisfied without being copied
+        resolution = self.resolve()
+        self.assertEqual([plugin.name for plugin in resolution.plugins],
+                         ["FakeMarketplaceZeroPlugin", "FakeMarketplaceOnePlugin"])
+        self.assertEqual(resolution.missing, {})
+
+    def test_missing_plugins(self):
+        with self.assertRaisesRegex(ditto.PluginResolutionError, "BlankPlugin required by FakeUnrealProject"):
+            self.resolve(unreal_install_paths=[])
+        self.set_dependencies(self.plugin("FakeMarketplaceOnePlugin"), "NotInstalledPlugin")
+        with self.assertRaisesRegex(ditto.PluginResolutionError,
+                                    "NotInstalledPlugin required by FakeUnrealProject.uproject -> "
+                                    "FakeMarketplaceOnePlugin is not available"):
+            self.resolve()
+        resolution = self.resolve(allow_missing=True)
+        self.assertEqual(resolution.missing, {"NotInstalledPlugin": ("FakeUnrealProject.uproject",
+                                                                     "FakeMarketplaceOnePlugin")})
+        self.assertEqual([plugin.name for plugin in resolution.plugins], ["FakeMarketplaceOnePlugin"])
+
+        # A plugin already in the project satisfies the reference without being copied again
+        ditto.make_mock_unreal_plugin(path=self.project_plugins_path, plugin_name="NotInstalled")
+        resolution = self.resolve()
+        self.assertEqual([plugin.name for plugin in resolution.plugins], ["FakeMarketplaceOnePlugin"])
+
+    def test_engine_plugin_files(self):
+        plugin_names = {plugin_file.stem for plugin_file in ditto.iter_ue_engine_plugin_files(self.install_path)}
+        self.assertEqual(plugin_names, {"BlankPlugin", "ScriptPlugin", *(plugin.name for plugin in self.plugins)})
+
+    def test_cycle(self):
+        self.set_dependencies(self.plugin("FakeMarketplaceOnePlugin"), "FakeMarketplaceTwoPlugin")
+        self.set_dependencies(self.plugin("FakeMarketplaceTwoPlugin"), "FakeMarketplaceOnePlugin")
+        with self.assertRaisesRegex(ditto.PluginResolutionError,
+                                    "FakeMarketplaceOnePlugin -> FakeMarketplaceTwoPlugin -> FakeMarketplaceOnePlugin"):
+            self.resolve()